@@ -1,18 +1,26 @@
 import os
 import logging
-from flask import Flask, request, render_template, send_from_directory, flash, redirect, url_for, session, jsonify, send_file
+from flask import (Flask, request, render_template, send_from_directory, flash, redirect, url_for, session, jsonify, send_file,
+                   Response, stream_with_context)
 from werkzeug.utils import secure_filename
-import workorder_classification
-import pandas as pd
-import requests
+from ingest import (conversation_hash, WorkOrderStream, message_line, chunk_messages, chunk_text,
+                    work_order_costs)
 import json
 import time
 import uuid
-from collections import defaultdict
-from tqdm import tqdm
+import hashlib
+import asyncio
 import threading
-import queue
-import concurrent.futures
+from llm_client import AsyncDashScopeClient, estimate_tokens, get_request_slots
+from task_store import get_task_store
+from job_scheduler import JobScheduler, lpt_order, WORK_ORDER_LOOKAHEAD
+from export import export_results, EXPORT_FORMATS
+from prefilter import WorkOrderFilter
+from progress import ProgressTracker
+from fingerprint_store import get_fingerprint_store, work_order_fingerprint
+from metrics import render_metrics, record_stage, QUEUE_DEPTH, JOBS, TASKS
+# pandas、numpy（dedup、search_index）、openpyxl、aiohttp、pyarrow 在用到的地方才导入：
+# Serverless冷启动时只查询状态的请求不需要加载这些库
 
 # 强制内存模式 - 不存储任何文件
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
@@ -26,139 +34,105 @@ app.secret_key = 'your-secret-key-here'  # 请更改为随机字符串
 UPLOAD_FOLDER = None
 RESULT_FOLDER = None
 
-# 存储任务状态
-task_status = {}
+# 存储任务状态和结果（默认保存在SQLite文件中，多个worker进程共享）
+task_store = get_task_store()
+# 标记为处理中的任务超过这个时间（秒）没有更新，视为处理进程已中断，允许通过 /resume 继续
+TASK_RESUME_STALE_SECONDS = float(os.getenv('TASK_RESUME_STALE_SECONDS', '300'))
+
+# 排队位置变化时写入任务状态，/status 可以看到前面还有多少个任务
+def _publish_queue_positions(positions):
+    for task_id, position in positions.items():
+        task_store.update(task_id, queue_position=position, status=f"排队中，前面还有 {position - 1} 个任务")
+
+# 任务调度器：同时运行的任务数固定，所有运行中的任务共用LLM_CONCURRENCY个并发请求（llm_client.get_request_slots）
+job_scheduler = JobScheduler(on_change=_publish_queue_positions)
+
+# 进度推送（/events）检查任务状态的间隔（秒），只有字段发生变化时才推送
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', '0.5'))
+# 没有变化时发送保活注释的间隔（秒），避免代理关闭空闲连接
+SSE_KEEPALIVE_SECONDS = 15
+# 单次推送连接的最长时间（秒），到时关闭连接，浏览器的EventSource稍后自动重连并重新收到完整状态。
+# 同步worker（如gunicorn默认的sync）每个连接占用一个worker，限制时长后长任务也不会一直占着worker
+SSE_MAX_STREAM_SECONDS = float(os.getenv('SSE_MAX_STREAM_SECONDS', '60'))
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# 读取Excel文件（支持文件路径和文件对象）
-def read_excel(file_input):
+# 读取表单中的开关选项（复选框勾选时为'on'）
+def form_flag(name):
+    return request.form.get(name, '').strip().lower() in ('1', 'true', 'on', 'yes')
+
+# 调度用的租户标识：同一API密钥的任务属于同一租户（只使用哈希，不保存密钥本身）
+def tenant_key(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+# 工单指纹库的命名空间：租户、模型和处理模式（单次调用与“格式化+提取”的结果不同，不互相复用）
+def fingerprint_namespace(api_key, single_pass=False):
+    return f"{tenant_key(api_key)}:{QA_EXTRACT_MODEL}:{'single_pass' if single_pass else 'two_pass'}"
+
+# 流式读取Excel并按工单分组，逐个工单产出消息（支持文件路径和文件对象）
+def read_work_orders(file_input):
     try:
-        if isinstance(file_input, str):
-            # 文件路径模式
-            df = pd.read_excel(file_input)
-        else:
-            # 文件对象模式（内存中）
-            # 先将文件内容读取到内存中，避免文件流被关闭
-            from io import BytesIO
-            if hasattr(file_input, 'read'):
-                # 如果是文件流对象
-                file_content = file_input.read()
-                df = pd.read_excel(BytesIO(file_content))
-            else:
-                # 直接传递文件对象
-                df = pd.read_excel(file_input)
-        return df
+        return WorkOrderStream(file_input)
     except Exception as e:
-        print(f"读取Excel文件时出错: {e}")
+        logging.error(f"读取Excel文件时出错: {e}")
         return None
 
-# 按工单ID分组对话内容
-def group_by_work_order(df):
-    work_orders = defaultdict(list)
-    
-    # 确保数据按created_at排序
-    df = df.sort_values(by=['work_order_id', 'created_at'])
-    
-    # 添加进度条
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="分组工单数据"):
-        work_id = row['work_order_id']
-        content = row['content']
-        user_name = row['oa_user_name']
-        
-        # 跳过空内容或AI回复（oa_user_name为空）
-        if pd.isna(content) or content.strip() == '' or pd.isna(user_name):
-            continue
-            
-        work_orders[work_id].append({
-            'user': user_name,
-            'content': content
-        })
-    
-    return work_orders
-
-# 通用API调用函数
-def call_dashscope_api(api_key, model, system_prompt, user_prompt, max_retries=3, timeout=90, enable_thinking=False):
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    if model.startswith('qwen3'):
-        url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-        payload = {
-            "model": model,
-            "input": {
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-        },
-            "extra_body": {"enable_thinking": enable_thinking} if enable_thinking else {}
-        }
-    else:
-        url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "extra_body": {"enable_thinking": enable_thinking} if enable_thinking else {}
-        }
-    for retry in range(max_retries):
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=timeout)
-            response.raise_for_status()
-            result = response.json()
-            if model.startswith('qwen3'):
-                if 'output' in result and 'text' in result['output']:
-                    return result['output']['text'].strip()
-            else:
-                if 'choices' in result and len(result['choices']) > 0 and 'message' in result['choices'][0]:
-                    return result['choices'][0]['message']['content'].strip()
-        except requests.exceptions.Timeout:
-            logging.warning(f"API请求超时，重试 {retry+1}/{max_retries}")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"API调用出错: {e}")
-        time.sleep(2 ** retry)  # 指数退避
-    return None
-
-# 调用百炼API整理对话
-def format_conversations(api_key, conversations, task_id):
-    formatted_texts = {}
-    total_work_orders = len(conversations)
-    processed_count = 0
-
-    def process_conversation(work_id, messages):
-        nonlocal processed_count
-        conversation_text = "\n".join([f"{msg['user']}: {msg['content']}" for msg in messages])
-        prompt = f"""以下是一段工单对话记录，其中说话者名称为oa_user_name。请分析并整理成易于分析的文本格式，区分用户和工作人员的角色（基于名称或内容上下文判断用户是提问者，工作人员是回答者），删除任何AI或系统回复，并格式化为：\nUser: [内容]\nStaff: [内容]\n...\n如果无法区分或没有有效内容，返回空字符串。\n\n对话内容：\n{conversation_text}\n\n请返回整理后的文本。"""
-        system_prompt = "你是一个专业的对话整理助手，擅长从工单记录中区分角色并格式化文本。"
-        formatted_text = call_dashscope_api(api_key, "qwen-plus", system_prompt, prompt)
-        if formatted_text:
-            formatted_texts[work_id] = formatted_text
-        processed_count += 1
-        progress = (processed_count / total_work_orders) * 100
-        task_status[task_id]['progress'] = progress
-        task_status[task_id]['status'] = f"正在格式化工单 {work_id} ({processed_count}/{total_work_orders})"
+# QA提取使用的模型，导出结果中会记录
+QA_EXTRACT_MODEL = "qwen-max"
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(process_conversation, work_id, messages) for work_id, messages in conversations.items()]
-        concurrent.futures.wait(futures)
+# 单次请求中对话内容的token预算：超出的长工单按消息（整理后按行）切分为多个窗口并发处理后合并，
+# 避免超出模型上下文或请求超时
+CONVERSATION_CHUNK_TOKENS = int(os.getenv('CONVERSATION_CHUNK_TOKENS', '3000'))
+# 提取QA对时相邻窗口重叠的消息（行）数，跨越切分点的问答不会丢失
+CONVERSATION_CHUNK_OVERLAP = int(os.getenv('CONVERSATION_CHUNK_OVERLAP', '2'))
 
-    return formatted_texts
+# 并发处理长工单的各个窗口，全部成功时按顺序返回各窗口的结果，任一窗口失败（返回None）时返回None
+async def _map_chunks(chunks, handler):
+    results = await asyncio.gather(*(handler(chunk) for chunk in chunks))
+    if any(result is None for result in results):
+        return None
+    return results
 
-# 调用百炼API生成QA对
-def generate_qa_pairs(api_key, formatted_texts, task_id):
-    qa_pairs = []
-    total_work_orders = len(formatted_texts)
-    processed_count = 0
+# 合并各窗口提取的QA对，去掉重叠部分重复提取的相同QA对
+def _merge_chunk_qa_pairs(results):
+    if results is None:
+        return None
+    merged, seen = [], set()
+    for qa in (qa for qa_pairs in results for qa in qa_pairs):
+        key = (qa['question'], qa['answer'])
+        if key not in seen:
+            seen.add(key)
+            merged.append(qa)
+    return merged
+
+# 调用百炼API整理单个工单的对话，返回整理后的文本；长对话分窗口整理后按顺序拼接
+async def format_conversation(client, messages):
+    results = await _map_chunks(chunk_messages(messages, CONVERSATION_CHUNK_TOKENS),
+                                lambda chunk: _format_chunk(client, chunk))
+    if results is None:
+        return None
+    return "\n".join(text for text in results if text)
+
+# 整理对话的提示词，{text}为逐行的对话内容
+FORMAT_SYSTEM_PROMPT = "你是一个专业的对话整理助手，擅长从工单记录中区分角色并格式化文本。"
+FORMAT_PROMPT = """以下是一段工单对话记录，其中说话者名称为oa_user_name。请分析并整理成易于分析的文本格式，区分用户和工作人员的角色（基于名称或内容上下文判断用户是提问者，工作人员是回答者），删除任何AI或系统回复，并格式化为：\nUser: [内容]\nStaff: [内容]\n...\n如果无法区分或没有有效内容，返回空字符串。\n\n对话内容：\n{text}\n\n请返回整理后的文本。"""
+
+async def _format_chunk(client, messages):
+    conversation_text = "\n".join(message_line(msg) for msg in messages)
+    prompt = FORMAT_PROMPT.format(text=conversation_text)
+    system_prompt = FORMAT_SYSTEM_PROMPT
+    return await client.chat("qwen-plus", system_prompt, prompt, stage="format")
 
-    def process_formatted_text(work_id, text):
-        nonlocal processed_count
-        prompt = f"""角色
+# 调用百炼API从单个工单的整理文本中提取QA对；长文本按行切分为重叠的窗口分别提取后合并
+async def extract_qa_pairs(client, work_id, text):
+    chunks = chunk_text(text, CONVERSATION_CHUNK_TOKENS, CONVERSATION_CHUNK_OVERLAP)
+    return _merge_chunk_qa_pairs(await _map_chunks(chunks, lambda chunk: _extract_chunk(client, work_id, chunk)))
+
+# 从整理后的文本提取QA对的提示词，{text}为整理后的文本
+EXTRACT_SYSTEM_PROMPT = "你是一个工单问答提取助手。你的任务是根据以下工单对话内容,理解并抽取出核心问题和对应的解决方案或回答。请确保提取的答案是完整且准确的,并且只包含与问题直接相关的信息。如果对话中没有明确的答案,请说明。请以JSON格式输出结果。如果存在多个问答对,请输出一个JSON数组。"
+EXTRACT_PROMPT = """角色
 你是一个从工单记录中提取问题和解决方案的助手。你的任务是从给定的工单记录中识别出问题（即用户遇到的困难或故障）和相应的解决方案（即为解决问题采取的措施或行动），并将它们整理成 QA 对。任务
 请从以下工单记录中提取问题和解决方案，并以指定的格式输出。如果工单记录中包含多个问题或解决方案，请将每个 QA 对分别列出。
 如果问题或解决方案没有明确说明，根据上下文进行推断。
@@ -184,43 +158,80 @@ def generate_qa_pairs(api_key, formatted_texts, task_id):
   ]
 }}
 """
-        system_prompt = "你是一个工单问答提取助手。你的任务是根据以下工单对话内容,理解并抽取出核心问题和对应的解决方案或回答。请确保提取的答案是完整且准确的,并且只包含与问题直接相关的信息。如果对话中没有明确的答案,请说明。请以JSON格式输出结果。如果存在多个问答对,请输出一个JSON数组。"
-        response_text = call_dashscope_api(api_key, "qwen-max", system_prompt, prompt)
-        if response_text:
-            try:
-                json_start = response_text.find('{')
-                json_end = response_text.rfind('}')
-                if json_start != -1 and json_end != -1:
-                    json_str = response_text[json_start:json_end+1]
-                    qa_data = json.loads(json_str)
-                    if 'qa_pairs' in qa_data and len(qa_data['qa_pairs']) > 0:
-                        for qa in qa_data['qa_pairs']:
-                            qa_pairs.append({
-                                'work_order_id': work_id,
-                                'question': qa['question'],
-                                'answer': qa['answer']
-                            })
-            except Exception as e:
-                logging.error(f"解析工单 {work_id} 的JSON结果时出错: {e}")
-        processed_count += 1
-        progress = (processed_count / total_work_orders) * 100
-        task_status[task_id]['progress'] = progress
-        task_status[task_id]['status'] = f"正在处理工单 {work_id} ({processed_count}/{total_work_orders})"
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(process_formatted_text, work_id, text) for work_id, text in formatted_texts.items()]
-        concurrent.futures.wait(futures)
 
-    return qa_pairs
+async def _extract_chunk(client, work_id, text):
+    prompt = EXTRACT_PROMPT.format(text=text)
+    system_prompt = EXTRACT_SYSTEM_PROMPT
+    response_text = await client.chat(QA_EXTRACT_MODEL, system_prompt, prompt, stage="extract")
+    return _parse_qa_pairs(work_id, response_text)
 
-def clean_qa_pairs(api_key, qa_pairs, task_id):
-    cleaned_qa = []
-    total_pairs = len(qa_pairs)
-    processed_count = 0
+# 单次调用模式：跳过对话整理，直接从分组后的原始消息中区分角色并提取QA对；长对话分窗口提取后合并
+async def extract_qa_pairs_direct(client, work_id, messages):
+    chunks = chunk_messages(messages, CONVERSATION_CHUNK_TOKENS, CONVERSATION_CHUNK_OVERLAP)
+    return _merge_chunk_qa_pairs(await _map_chunks(chunks, lambda chunk: _extract_direct_chunk(client, work_id, chunk)))
+
+# 单次调用模式直接从对话提取QA对的提示词，{text}为逐行的对话内容
+EXTRACT_DIRECT_SYSTEM_PROMPT = "你是一个工单问答提取助手。你需要先根据工单对话内容区分用户和工作人员的角色，再理解并抽取出用户的核心问题和工作人员给出的解决方案。请确保提取的答案是完整且准确的,并且只包含与问题直接相关的信息。请以JSON格式输出结果。"
+EXTRACT_DIRECT_PROMPT = """角色
+你是一个从工单对话记录中提取问题和解决方案的助手。对话记录每行的格式为“说话者名称(oa_user_name): 内容”。
+请先根据名称或内容上下文区分用户（提问者）和工作人员（回答者），忽略任何AI或系统回复；再从用户报告的问题和工作人员给出的解决方案中整理出 QA 对。
+任务
+请从以下工单对话中提取问题和解决方案，并以指定的格式输出。如果对话中包含多个问题或解决方案，请将每个 QA 对分别列出。
+如果问题或解决方案没有明确说明，根据上下文进行推断。
+如果无法推断，或对话中没有有效内容，返回空的qa_pairs。
+请确保提取的信息准确无误，不要添加额外的内容或臆测。
+
+注意事项  问题通常是用户遇到的故障或异常现象，解决方案则是工作人员为解决问题而采取的具体行动。
+如果对话中包含多个独立的问题和解决方案，请为每个问题和其对应的解决方案生成一个 QA 对。
 
-    def process_qa_pair(qa):
-        nonlocal processed_count
-        prompt = f"""目标： 指示LLM充当问答对的客观、专家评估员，判断其“真实性”（事实准确性、溯源性、无幻觉）和“有效性”（相关性、连贯性、实用性）。
+
+对话内容：
+{text}
+
+请提取问答对，格式如下：
+{{
+  "qa_pairs": [
+    {{
+      "question": "问题1",
+      "answer": "回答1"
+    }},
+    ...
+  ]
+}}
+"""
+
+async def _extract_direct_chunk(client, work_id, messages):
+    conversation_text = "\n".join(message_line(msg) for msg in messages)
+    prompt = EXTRACT_DIRECT_PROMPT.format(text=conversation_text)
+    system_prompt = EXTRACT_DIRECT_SYSTEM_PROMPT
+    response_text = await client.chat(QA_EXTRACT_MODEL, system_prompt, prompt, stage="extract")
+    return _parse_qa_pairs(work_id, response_text)
+
+# 从模型回复中解析QA对，API调用失败（没有回复）时返回None
+def _parse_qa_pairs(work_id, response_text):
+    if response_text is None:
+        return None
+    qa_pairs = []
+    if response_text:
+        try:
+            json_start = response_text.find('{')
+            json_end = response_text.rfind('}')
+            if json_start != -1 and json_end != -1:
+                json_str = response_text[json_start:json_end+1]
+                qa_data = json.loads(json_str)
+                if 'qa_pairs' in qa_data and len(qa_data['qa_pairs']) > 0:
+                    for qa in qa_data['qa_pairs']:
+                        qa_pairs.append({
+                            'work_order_id': work_id,
+                            'question': qa['question'],
+                            'answer': qa['answer']
+                        })
+        except Exception as e:
+            logging.error(f"解析工单 {work_id} 的JSON结果时出错: {e}")
+    return qa_pairs
+
+# QA对验证标准（单条验证和批量验证共用）
+QA_VALIDATION_RUBRIC = """目标： 指示LLM充当问答对的客观、专家评估员，判断其“真实性”（事实准确性、溯源性、无幻觉）和“有效性”（相关性、连贯性、实用性）。
 角色分配： 提示开头明确定义LLM的角色和任务：
 "您是一位资深的自然语言处理研究员和问答系统评估专家。您的任务是根据预定义的‘真实性’和‘有效性’标准，严格评估给定问答对（QA Pair）的质量。
 
@@ -233,28 +244,655 @@ def clean_qa_pairs(api_key, qa_pairs, task_id):
 相关性	答案是否直接、完整地回应了问题，并满足了用户的潜在信息需求？ 
 连贯性与清晰度	答案是否结构良好、逻辑流畅、易于理解、语法正确且无歧义？
 完整性与特异性	答案是否提供了足够详细的信息，既不冗长也不遗漏关键点？	
-实用性与帮助性	答案是否对用户有用，提供可操作的见解或解决了实际问题？	
+实用性与帮助性	答案是否对用户有用，提供可操作的见解或解决了实际问题？	"""
+
+# 批量验证时每个请求包含的QA对数量，1表示逐条验证
+QA_CLEAN_BATCH_SIZE = int(os.getenv('QA_CLEAN_BATCH_SIZE', '10'))
+
+# 调用百炼API验证单个QA对，符合要求返回True，API调用失败时返回None
+async def validate_qa_pair(client, qa):
+    prompt = f"""{QA_VALIDATION_RUBRIC}
 
 如果符合，返回'yes'，否则'no'。只返回'yes'或'no'。
 问题: {qa['question']}
 答案: {qa['answer']}"""
-        system_prompt = "你是一个QA验证助手，使用推理模式评估QA对的真实性和相关性。"
-        response = call_dashscope_api(api_key, "qwen-plus", system_prompt, prompt)
-        if response and response.lower() == 'yes':
-            cleaned_qa.append(qa)
-        processed_count += 1
-        progress = 50 + (processed_count / total_pairs) * 40  # 从50%到90%
-        task_status[task_id]['progress'] = progress
-        task_status[task_id]['status'] = f"正在清洗QA对 ({processed_count}/{total_pairs})"
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(process_qa_pair, qa) for qa in qa_pairs]
-        concurrent.futures.wait(futures)
+    system_prompt = "你是一个QA验证助手，使用推理模式评估QA对的真实性和相关性。"
+    response = await client.chat("qwen-plus", system_prompt, prompt, stage="clean")
+    if response is None:
+        return None
+    return response.lower() == 'yes'
+
+# 解析批量验证结果，返回与QA对等长的列表，缺失或格式错误的条目为None
+def _parse_batch_verdicts(response_text, count):
+    verdicts = [None] * count
+    if not response_text:
+        return verdicts
+    try:
+        json_start = response_text.find('{')
+        json_end = response_text.rfind('}')
+        if json_start == -1 or json_end == -1:
+            return verdicts
+        results = json.loads(response_text[json_start:json_end+1]).get('results')
+        if not isinstance(results, list):
+            return verdicts
+        for item in results:
+            if not isinstance(item, dict):
+                continue
+            index = item.get('index')
+            verdict = str(item.get('verdict', '')).strip().lower()
+            if isinstance(index, int) and 0 <= index < count and verdict in ('yes', 'no'):
+                verdicts[index] = verdict == 'yes'
+    except (ValueError, AttributeError) as e:
+        logging.warning(f"解析批量验证结果时出错: {e}")
+    return verdicts
+
+# 调用百炼API批量验证QA对：评估标准只发送一次，模型按编号逐条返回yes/no；
+# 没有得到有效判定的条目回退为单条验证。返回与qas等长的True/False列表，单条验证也失败的条目为None
+async def validate_qa_batch(client, qas):
+    if len(qas) == 1:
+        return [await validate_qa_pair(client, qas[0])]
+    pairs_text = "\n\n".join(
+        f"[{index}] 问题: {qa['question']}\n答案: {qa['answer']}" for index, qa in enumerate(qas)
+    )
+    prompt = f"""{QA_VALIDATION_RUBRIC}
+
+以下共有 {len(qas)} 个问答对，编号从0开始。请按上述标准逐个评估，符合的判定为'yes'，否则为'no'。
+只返回JSON，不要输出其他内容，格式如下：
+{{"results": [{{"index": 0, "verdict": "yes"}}, {{"index": 1, "verdict": "no"}}]}}
+
+{pairs_text}"""
+    system_prompt = "你是一个批量QA验证助手，使用推理模式逐条评估QA对的真实性和相关性，并按编号输出JSON结果。"
+    response = await client.chat("qwen-plus", system_prompt, prompt, stage="clean")
+    verdicts = _parse_batch_verdicts(response, len(qas))
+    missing = [index for index, verdict in enumerate(verdicts) if verdict is None]
+    if missing:
+        logging.warning(f"批量验证有 {len(missing)}/{len(qas)} 条结果缺失或格式错误，回退为逐条验证")
+        fallback = await asyncio.gather(*[validate_qa_pair(client, qas[index]) for index in missing])
+        for index, verdict in zip(missing, fallback):
+            verdicts[index] = verdict
+    return verdicts
+
+# 按batch_size切分列表
+def _batched(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+# 并发执行handler，同时进行中的任务不超过limit个；items可以是流式读取的工单，不会一次性全部展开。
+# handler抛出异常时记录日志并调用on_error(item, 异常)，其余条目继续处理
+async def _run_bounded(items, handler, limit, on_error=None):
+    slots = asyncio.Semaphore(limit)
+    tasks = set()
+
+    def finish(task, item):
+        tasks.discard(task)
+        slots.release()
+        if task.cancelled() or task.exception() is None:
+            return
+        logging.error(f"处理出错: {task.exception()!r}")
+        if on_error:
+            on_error(item, task.exception())
+
+    try:
+        for item in items:
+            await slots.acquire()
+            task = asyncio.create_task(handler(item))
+            tasks.add(task)
+            task.add_done_callback(lambda t, item=item: finish(t, item))
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        # 被取消时一并取消进行中的任务
+        for task in list(tasks):
+            task.cancel()
+
+
+# 更新任务进度，同时记录各阶段的缓存命中情况和API调用统计
+def _report_progress(client, task_id, progress, status, eta_seconds=None):
+    task_store.update(task_id, progress=progress, status=status, eta_seconds=eta_seconds,
+                      cache_stats=client.cache_stats, call_stats=client.call_stats)
+
+_STAGE_LABELS = {'format': '格式化', 'extract': '提取', 'clean': '清洗'}
+
+# 任务的进度统计：按间隔把各阶段计数、总进度和预计剩余时间写入任务状态。
+# 进度从start到end；deduplicated只计数，合并掉的重复项同时计为已清洗
+def _progress_tracker(client, task_id, title, prefilter=None, start=20, end=90):
+    def publish(tracker, progress, eta):
+        parts = [f"跳过 {prefilter.skipped_total}"] if prefilter and prefilter.skipped_total else []
+        deduplicated = tracker.done('deduplicated')
+        for name, label in _STAGE_LABELS.items():
+            if name in tracker:
+                offset = deduplicated if name == 'clean' else 0
+                parts.append(f"{label} {tracker.done(name) - offset}/{tracker.total(name) - offset}")
+        if deduplicated:
+            parts.append(f"合并重复 {deduplicated}")
+        status = f"{title}：{'，'.join(parts)}"
+        if eta is not None and eta >= 1:
+            status += f"，预计还需 {eta:.0f} 秒"
+        _report_progress(client, task_id, progress, status, eta)
+    return ProgressTracker(publish, start, end).add_stage('deduplicated', 0)
+
+# 每次调用中对话内容以外的提示词token数（系统提示词和模板）
+def _prompt_tokens(system_prompt, template):
+    return estimate_tokens(system_prompt) + estimate_tokens(template.format(text=''))
+
+# 完整处理流程的各阶段：工单总数已知；清洗的QA对在提取过程中逐步产生，完成比例按提取进度折算。
+# 各阶段的权重和各工单的工作量都按预计处理的token数计算（costs为各工单对话的估算token数）：
+# 格式化输入提示词和对话、输出整理后的全文，提取输入提示词和对话；
+# 清洗按已提取QA对的token数（见_add_clean_total）和已提取的比例推算全部工单
+def _work_order_progress(client, task_id, title, costs, single_pass=False, prefilter=None):
+    tracker = _progress_tracker(client, task_id, title, prefilter)
+    if single_pass:
+        extract_prompt = _prompt_tokens(EXTRACT_DIRECT_SYSTEM_PROMPT, EXTRACT_DIRECT_PROMPT)
+    else:
+        format_prompt = _prompt_tokens(FORMAT_SYSTEM_PROMPT, FORMAT_PROMPT)
+        format_costs = {work_id: format_prompt + 2 * cost for work_id, cost in costs.items()}
+        tracker.add_stage('format', sum(format_costs.values()), len(costs), costs=format_costs)
+        extract_prompt = _prompt_tokens(EXTRACT_SYSTEM_PROMPT, EXTRACT_PROMPT)
+    extract_costs = {work_id: extract_prompt + cost for work_id, cost in costs.items()}
+    tracker.add_stage('extract', sum(extract_costs.values()), len(costs), costs=extract_costs)
+
+    def clean_weight(tracker):
+        extracted = tracker.fraction('extract')
+        return tracker.work('clean') / extracted if extracted else 0.0
+    return tracker.add_stage('clean', clean_weight, scale_by='extract')
+
+# 提取出的QA对计入清洗阶段的总数，工作量为QA对内容加分摊到每个QA对的验证提示词的token数
+def _add_clean_total(progress, qa_pairs):
+    if 'clean' not in progress:
+        return
+    prompt = estimate_tokens(QA_VALIDATION_RUBRIC) / QA_CLEAN_BATCH_SIZE
+    work = sum(estimate_tokens(f"{qa['question']}{qa['answer']}") + prompt for qa in qa_pairs)
+    progress.add_total('clean', len(qa_pairs), work)
+
+# 合并掉的近似重复QA对不再清洗，直接计为已清洗
+def _track_merged(progress, count):
+    if count:
+        progress.advance('deduplicated', count)
+        progress.advance('clean', count)
+
+# 任务断点：按工单记录格式化、提取、清洗各阶段的结果，任务中断或部分工单失败后，
+# 重新运行时跳过已完成的阶段，只处理缺失或失败的工单。工单键统一转为字符串
+class TaskCheckpoint:
+    # fingerprints为工单指纹库时，内容与之前上传过的工单相同的工单直接复用之前的清洗结果，
+    # namespace区分不同租户、模型和处理模式的结果（fingerprint_namespace）
+    def __init__(self, task_id, fingerprints=None, namespace=''):
+        self.task_id = task_id
+        self.formatted = task_store.get_checkpoints(task_id, 'format')
+        self.extracted = task_store.get_checkpoints(task_id, 'extract')
+        self.cleaned = task_store.get_checkpoints(task_id, 'clean')
+        self.fingerprints = fingerprints
+        self.namespace = namespace
+        self.failed = set()
+        self.restored = []
+        self.restored_count = 0
+        self.reused_count = 0
+        self._pending = {}
+        self._kept = {}
+        self._work_fingerprints = {}
+        self._merged = set()
+
+    def save_formatted(self, work_id, text):
+        task_store.save_checkpoint(self.task_id, 'format', work_id, text)
+        # 没有有效内容的工单不会进入后续阶段，直接记为已完成
+        if not text:
+            self.save_extracted(work_id, [])
+
+    # 记录工单提取出的QA对，并开始跟踪这些QA对的清洗结果
+    def save_extracted(self, work_id, qa_pairs):
+        task_store.save_checkpoint(self.task_id, 'extract', work_id, qa_pairs)
+        self.track(work_id, qa_pairs)
+
+    def track(self, work_id, qa_pairs):
+        key = str(work_id)
+        if not qa_pairs:
+            self._save_cleaned(key, [])
+            return
+        self._pending[key] = len(qa_pairs)
+        self._kept[key] = []
+
+    # 记录一批QA对的验证结果；工单的所有QA对都得到判定后记录该工单的清洗结果
+    def save_verdicts(self, qa_pairs, verdicts):
+        for qa, verdict in zip(qa_pairs, verdicts):
+            key = str(qa['work_order_id'])
+            if key not in self._pending:
+                continue
+            if verdict is None:
+                self.failed.add(key)
+            elif verdict:
+                self._kept[key].append(qa)
+            self._pending[key] -= 1
+            if self._pending[key] == 0:
+                del self._pending[key]
+                kept = self._kept.pop(key)
+                if key not in self.failed:
+                    self._save_cleaned(key, kept)
+
+    def mark_failed(self, work_id):
+        self.failed.add(str(work_id))
+
+    # 记录去重时被合并到其他工单的QA对：这些QA对不再清洗，所属工单的结果取决于同一任务中的其他工单，
+    # 不写入指纹库（否则之后单独上传该工单时会复用缺少这些QA对的结果）
+    def save_merged(self, qa_pairs):
+        self._merged.update(str(qa['work_order_id']) for qa in qa_pairs)
+        self.save_verdicts(qa_pairs, [False] * len(qa_pairs))
+
+    # 记录工单的清洗结果，并写入指纹库供之后上传的相同工单复用（合并的重复工单ID只对本次任务有效，不保存）
+    def _save_cleaned(self, key, kept):
+        task_store.save_checkpoint(self.task_id, 'clean', key, kept)
+        fingerprint = self._work_fingerprints.pop(key, None)
+        if fingerprint is not None and key not in self._merged:
+            self.fingerprints.put(fingerprint, [
+                {field: value for field, value in qa.items() if field != 'duplicate_work_order_ids'} for qa in kept
+            ])
+
+    # 已在之前的运行中清洗完成的工单，或内容与指纹库中的工单相同：取出保存的结果，返回True
+    def restore_cleaned(self, work_id, messages=None):
+        key = str(work_id)
+        kept = self.cleaned.get(key)
+        if kept is not None:
+            self.restored_count += 1
+        elif self.fingerprints is not None and messages is not None:
+            fingerprint = work_order_fingerprint(self.namespace, messages)
+            kept = self.fingerprints.get(fingerprint)
+            if kept is None:
+                self._work_fingerprints[key] = fingerprint
+                return False
+            kept = [dict(qa, work_order_id=work_id) for qa in kept]
+            # 同时记为本任务的断点，中断后继续时不需要再查指纹库
+            task_store.save_checkpoint(self.task_id, 'clean', key, kept)
+            self.reused_count += 1
+        else:
+            return False
+        self.restored.extend(kept)
+        return True
+
+# 工单的溯源信息：原始对话哈希和格式化耗时（秒，未经过格式化或使用断点时为None），提取时写入每个QA对
+def _source_metadata(messages, format_seconds=None):
+    return {'source_hash': conversation_hash(messages), 'format_seconds': format_seconds}
+
+# 格式化单个工单的对话：有断点时直接使用，否则调用API并记录断点。
+# 返回 (格式化文本, 溯源信息)，API调用失败时文本为None
+async def _checkpointed_format(client, checkpoint, work_id, messages):
+    key = str(work_id)
+    if checkpoint and key in checkpoint.formatted:
+        return checkpoint.formatted[key], _source_metadata(messages)
+    start = time.perf_counter()
+    formatted_text = await format_conversation(client, messages)
+    elapsed = time.perf_counter() - start
+    record_stage('format', elapsed)
+    metadata = _source_metadata(messages, round(elapsed, 3))
+    if checkpoint:
+        if formatted_text is None:
+            checkpoint.mark_failed(work_id)
+        else:
+            checkpoint.save_formatted(work_id, formatted_text)
+    return formatted_text, metadata
+
+# 提取单个工单的QA对：有断点时直接使用，否则调用extract()，为QA对附加溯源信息、模型和提取耗时后记录断点。
+# API调用失败时返回空列表
+async def _checkpointed_extract(checkpoint, work_id, extract, metadata):
+    key = str(work_id)
+    if checkpoint and key in checkpoint.extracted:
+        qa_pairs = checkpoint.extracted[key]
+        checkpoint.track(work_id, qa_pairs)
+        return qa_pairs
+    start = time.perf_counter()
+    qa_pairs = await extract()
+    if qa_pairs is None:
+        if checkpoint:
+            checkpoint.mark_failed(work_id)
+        return []
+    elapsed = time.perf_counter() - start
+    record_stage('extract', elapsed)
+    extract_seconds = round(elapsed, 3)
+    for qa in qa_pairs:
+        qa.update(metadata, model=QA_EXTRACT_MODEL, extract_seconds=extract_seconds)
+    if checkpoint:
+        checkpoint.save_extracted(work_id, qa_pairs)
+    return qa_pairs
+
+# 批量验证QA对，并在每个QA对上记录所在批次的清洗耗时
+async def _timed_validate_batch(client, batch):
+    start = time.perf_counter()
+    verdicts = await validate_qa_batch(client, batch)
+    elapsed = time.perf_counter() - start
+    record_stage('clean', elapsed, len(batch))
+    clean_seconds = round(elapsed, 3)
+    for qa in batch:
+        qa['clean_seconds'] = clean_seconds
+    return verdicts
+
+# 清洗前去掉与已有QA对近似重复的项，返回需要清洗的QA对；重复项合并到代表QA对上，在断点中记为已处理
+def _deduplicate(dedup, checkpoint, qa_pairs):
+    if dedup is None:
+        return qa_pairs
+    unique, duplicates = dedup.split(qa_pairs)
+    if checkpoint and duplicates:
+        checkpoint.save_merged(duplicates)
+    return unique
+
+# 调用百炼API整理对话，返回 {工单ID: (格式化文本, 溯源信息)}；估算token数最多的工单最先处理，
+# prefilter为WorkOrderFilter时跳过没有有效内容的工单；progress为整个任务的ProgressTracker，不传时只统计本阶段
+async def format_conversations(client, conversations, task_id, checkpoint=None, prefilter=None, progress=None):
+    formatted_texts = {}
+    if progress is None:
+        progress = _progress_tracker(client, task_id, "正在格式化对话", prefilter, 0, 100)
+        progress.add_stage('format', 1, len(conversations))
+    costs = work_order_costs(conversations)
+
+    async def process_conversation(item):
+        work_id, messages = item
+        if checkpoint and checkpoint.restore_cleaned(work_id, messages):
+            formatted_text = None  # 之前已处理完成，跳过后续阶段
+        elif prefilter and prefilter.skip(messages):
+            formatted_text = None
+        else:
+            formatted_text, metadata = await _checkpointed_format(client, checkpoint, work_id, messages)
+        if formatted_text:
+            formatted_texts[work_id] = (formatted_text, metadata)
+        elif 'extract' in progress:
+            progress.advance('extract', item=work_id)  # 不进入提取阶段的工单直接计为已提取
+        progress.advance('format', item=work_id)
+
+    # 处理出错的工单记为失败，不进入后续阶段
+    def on_error(item, error):
+        if checkpoint:
+            checkpoint.mark_failed(item[0])
+        if 'extract' in progress:
+            progress.advance('extract', item=item[0])
+        progress.advance('format', item=item[0])
+
+    items = lpt_order(conversations.items(), lambda item: costs.get(item[0], 0), WORK_ORDER_LOOKAHEAD)
+    await _run_bounded(items, process_conversation, client.concurrency * 2, on_error)
+    return formatted_texts
+
+# 调用百炼API生成QA对，整理后文本最长的工单最先处理
+async def generate_qa_pairs(client, formatted_texts, task_id, checkpoint=None, progress=None):
+    qa_pairs = []
+    if progress is None:
+        progress = _progress_tracker(client, task_id, "正在生成QA对", start=0, end=100)
+        progress.add_stage('extract', 1, len(formatted_texts))
+
+    async def process_formatted_text(item):
+        work_id, (text, metadata) = item
+        found = await _checkpointed_extract(checkpoint, work_id, lambda: extract_qa_pairs(client, work_id, text), metadata)
+        qa_pairs.extend(found)
+        # 提取出的QA对随即计入清洗阶段的总数，清洗开始前总进度不会高估
+        _add_clean_total(progress, found)
+        progress.advance('extract', item=work_id)
+
+    def on_error(item, error):
+        if checkpoint:
+            checkpoint.mark_failed(item[0])
+        progress.advance('extract', item=item[0])
+
+    items = lpt_order(formatted_texts.items(), lambda item: estimate_tokens(item[1][0]))
+    await _run_bounded(items, process_formatted_text, client.concurrency * 2, on_error)
+    return qa_pairs
+
+# 单次调用模式：直接从分组后的工单消息生成QA对，估算token数最多的工单最先处理，
+# prefilter为WorkOrderFilter时跳过没有有效内容的工单
+async def generate_qa_pairs_direct(client, conversations, task_id, checkpoint=None, prefilter=None, progress=None):
+    qa_pairs = []
+    if progress is None:
+        progress = _progress_tracker(client, task_id, "正在生成QA对", prefilter, 0, 100)
+        progress.add_stage('extract', 1, len(conversations))
+    costs = work_order_costs(conversations)
+
+    async def process_conversation(item):
+        work_id, messages = item
+        if not (checkpoint and checkpoint.restore_cleaned(work_id, messages)) and not (prefilter and prefilter.skip(messages)):
+            found = await _checkpointed_extract(
+                checkpoint, work_id, lambda: extract_qa_pairs_direct(client, work_id, messages), _source_metadata(messages)
+            )
+            qa_pairs.extend(found)
+            _add_clean_total(progress, found)
+        progress.advance('extract', item=work_id)
+
+    def on_error(item, error):
+        if checkpoint:
+            checkpoint.mark_failed(item[0])
+        progress.advance('extract', item=item[0])
+
+    items = lpt_order(conversations.items(), lambda item: costs.get(item[0], 0), WORK_ORDER_LOOKAHEAD)
+    await _run_bounded(items, process_conversation, client.concurrency * 2, on_error)
+    return qa_pairs
+
+# 清洗QA对，batch_size大于1时按批验证；有断点时结果中包含之前已清洗完成的工单。
+# progress为整个任务的ProgressTracker时，这些QA对应已在提取时计入清洗阶段的总数
+async def clean_qa_pairs(client, qa_pairs, task_id, batch_size=None, checkpoint=None, progress=None):
+    batch_size = batch_size or QA_CLEAN_BATCH_SIZE
+    cleaned_qa = list(checkpoint.restored) if checkpoint else []
+    if progress is None:
+        progress = _progress_tracker(client, task_id, "正在清洗QA对", start=50, end=90)
+        progress.add_stage('clean', 1, len(qa_pairs))
+
+    async def process_qa_batch(batch):
+        verdicts = await _timed_validate_batch(client, batch)
+        if checkpoint:
+            checkpoint.save_verdicts(batch, verdicts)
+        cleaned_qa.extend(qa for qa, verdict in zip(batch, verdicts) if verdict)
+        progress.advance('clean', len(batch))
+
+    # 出错的批次按验证失败处理，所属工单记为失败
+    def on_error(batch, error):
+        if checkpoint:
+            checkpoint.save_verdicts(batch, [None] * len(batch))
+        progress.advance('clean', len(batch))
+
+    await _run_bounded(_batched(qa_pairs, batch_size), process_qa_batch, client.concurrency * 2, on_error)
+    return cleaned_qa
+
+# 流水线阶段结束标记
+_PIPELINE_STOP = object()
+
+# 运行中的流水线各阶段的输入队列 {id(queue): (阶段名, queue)}，/metrics 据此统计队列深度
+_pipeline_queues = {}
+_pipeline_queues_lock = threading.Lock()
+
+def _register_queues(named_queues, active):
+    with _pipeline_queues_lock:
+        for name, queue in named_queues:
+            if active:
+                _pipeline_queues[id(queue)] = (name, queue)
+            else:
+                _pipeline_queues.pop(id(queue), None)
+
+# 流水线阶段的工作协程：从in_queue取任务，handler返回的每个结果放入out_queue。
+# batch_size大于1时，取到第一个任务后最多再等待batch_linger秒凑满一批，以列表形式交给handler
+# handler抛出异常时记录日志并调用on_error(条目或批次, 异常)，与_run_bounded相同
+async def _pipeline_worker(name, handler, in_queue, out_queue, batch_size=1, batch_linger=1.0, on_error=None):
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        item = await in_queue.get()
+        if item is _PIPELINE_STOP:
+            break
+        if batch_size > 1:
+            batch = [item]
+            deadline = loop.time() + batch_linger
+            # 只用get_nowait轮询，不取消进行中的get，避免超时时丢失任务
+            while len(batch) < batch_size and not stopping:
+                if in_queue.empty():
+                    if loop.time() >= deadline:
+                        break
+                    await asyncio.sleep(0.05)
+                    continue
+                item = in_queue.get_nowait()
+                if item is _PIPELINE_STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            item = batch
+        try:
+            for result in await handler(item):
+                await out_queue.put(result)
+        except Exception as e:
+            logging.error(f"流水线阶段 {name} 处理出错: {e!r}")
+            if on_error:
+                on_error(item, e)
+
+# 流水线模式：格式化、提取、清洗三个阶段通过有界队列相连，
+# 每个工单完成上一阶段后立即进入下一阶段，不再等待所有工单完成；工单按估算token数从多到少送入流水线
+# single_pass为True时跳过格式化阶段，直接从原始消息提取QA对；
+# checkpoint不为None时逐个工单记录各阶段结果，之前已完成的工单和阶段直接使用记录的结果；
+# dedup为QADeduplicator时，提取出的QA对先去掉近似重复项再进入清洗阶段；
+# prefilter为WorkOrderFilter时，没有有效内容的工单不进入流水线；progress为ProgressTracker，不传时新建
+async def run_pipeline(client, work_orders, task_id, workers_per_stage=None, queue_size=None, batch_size=None,
+                       single_pass=False, checkpoint=None, dedup=None, prefilter=None, progress=None):
+    workers_per_stage = workers_per_stage or client.concurrency
+    batch_size = batch_size or QA_CLEAN_BATCH_SIZE
+    queue_size = queue_size or client.concurrency * 2
+    costs = work_order_costs(work_orders)
+    cleaned_qa = []
+    progress = progress or _work_order_progress(client, task_id, "流水线处理中", costs, single_pass, prefilter)
+
+    async def format_stage(item):
+        work_id, messages = item
+        formatted_text, metadata = await _checkpointed_format(client, checkpoint, work_id, messages)
+        if formatted_text:
+            progress.advance('format', item=work_id)
+            return [(work_id, formatted_text, metadata)]
+        # 没有有效内容的工单直接计为已提取
+        progress.advance('extract', item=work_id)
+        progress.advance('format', item=work_id)
+        return []
+
+    async def extract_stage(item):
+        work_id, text, metadata = item
+        qa_pairs = await _checkpointed_extract(
+            checkpoint, work_id, lambda: extract_qa_pairs(client, work_id, text), metadata
+        )
+        unique = _deduplicate(dedup, checkpoint, qa_pairs)
+        _add_clean_total(progress, qa_pairs)
+        _track_merged(progress, len(qa_pairs) - len(unique))
+        progress.advance('extract', item=work_id)
+        return unique
+
+    async def direct_extract_stage(item):
+        work_id, messages = item
+        qa_pairs = await _checkpointed_extract(
+            checkpoint, work_id, lambda: extract_qa_pairs_direct(client, work_id, messages), _source_metadata(messages)
+        )
+        unique = _deduplicate(dedup, checkpoint, qa_pairs)
+        _add_clean_total(progress, qa_pairs)
+        _track_merged(progress, len(qa_pairs) - len(unique))
+        progress.advance('extract', item=work_id)
+        return unique
+
+    async def clean_stage(batch):
+        verdicts = await _timed_validate_batch(client, batch)
+        if checkpoint:
+            checkpoint.save_verdicts(batch, verdicts)
+        cleaned_qa.extend(qa for qa, verdict in zip(batch, verdicts) if verdict)
+        progress.advance('clean', len(batch))
+        return []
+
+    # 处理出错的工单记为失败（清洗出错时整批QA对所属的工单），并计入对应阶段的进度
+    def format_failed(item, error):
+        if checkpoint:
+            checkpoint.mark_failed(item[0])
+        progress.advance('extract', item=item[0])
+        progress.advance('format', item=item[0])
+
+    def extract_failed(item, error):
+        if checkpoint:
+            checkpoint.mark_failed(item[0])
+        progress.advance('extract', item=item[0])
+
+    def clean_failed(batch, error):
+        if checkpoint:
+            checkpoint.save_verdicts(batch, [None] * len(batch))
+        progress.advance('clean', len(batch))
 
+    if single_pass:
+        stages = [('extract', direct_extract_stage, 1, extract_failed), ('clean', clean_stage, batch_size, clean_failed)]
+    else:
+        stages = [('format', format_stage, 1, format_failed), ('extract', extract_stage, 1, extract_failed),
+                  ('clean', clean_stage, batch_size, clean_failed)]
+    # 清洗阶段按批取任务，它的输入队列需要能容纳若干个批次
+    queue_sizes = [queue_size] * (len(stages) + 1)
+    queue_sizes[-2] = max(queue_size, batch_size * 2)
+    queues = [asyncio.Queue(maxsize=size) for size in queue_sizes]
+    workers = [
+        [asyncio.create_task(_pipeline_worker(name, handler, queues[index], queues[index + 1], stage_batch_size,
+                                              on_error=on_error))
+         for _ in range(workers_per_stage)]
+        for index, (name, handler, stage_batch_size, on_error) in enumerate(stages)
+    ]
+
+    named_queues = [(name, queues[index]) for index, (name, _, _, _) in enumerate(stages)]
+    _register_queues(named_queues, True)
+    try:
+        # 有界队列满时等待，读取速度受下游处理速度约束
+        for item in lpt_order(work_orders.items(), lambda item: costs.get(item[0], 0), WORK_ORDER_LOOKAHEAD):
+            if (checkpoint and checkpoint.restore_cleaned(*item)) or (prefilter and prefilter.skip(item[1])):
+                if not single_pass:
+                    progress.advance('format', item=item[0])
+                progress.advance('extract', item=item[0])
+                continue
+            await queues[0].put(item)
+
+        # 逐级关闭：上一阶段所有协程退出后再通知下一阶段结束
+        for index, stage_workers in enumerate(workers):
+            for _ in stage_workers:
+                await queues[index].put(_PIPELINE_STOP)
+            await asyncio.gather(*stage_workers)
+    finally:
+        # 被取消时停止所有阶段的工作协程，正常结束时它们都已退出
+        for stage_workers in workers:
+            for worker in stage_workers:
+                worker.cancel()
+        _register_queues(named_queues, False)
+
+    progress.maybe_publish(force=True)
+    if checkpoint:
+        cleaned_qa.extend(checkpoint.restored)
+    return cleaned_qa
+
+# 在同一个异步客户端（共享连接池和并发上限）下执行各阶段，返回清洗后的QA对。
+# single_pass为True时用一次调用直接从原始消息提取QA对，替代“格式化+提取”两次调用；
+# checkpoint为TaskCheckpoint时按工单记录断点，并跳过之前已完成的工作；
+# dedup为QADeduplicator时在清洗前合并近似重复的QA对；prefilter为WorkOrderFilter时在调用API前跳过没有有效内容的工单。
+# 不指定concurrency时与进程内其他任务共用LLM_CONCURRENCY个并发请求，指定时使用单独的上限
+async def process_work_orders(api_key, work_orders, task_id, pipeline=True, concurrency=None, single_pass=False,
+                              checkpoint=None, dedup=None, prefilter=None):
+    slots = None if concurrency else get_request_slots()
+    async with AsyncDashScopeClient(api_key, concurrency=concurrency, slots=slots) as client:
+        return await process_work_orders_with_client(client, work_orders, task_id, pipeline, single_pass,
+                                                     checkpoint, dedup, prefilter)
+
+# 使用已有的客户端处理工单，多个任务共用一个客户端时共享并发上限和限流
+async def process_work_orders_with_client(client, work_orders, task_id, pipeline=True, single_pass=False,
+                                          checkpoint=None, dedup=None, prefilter=None):
+    # 整个任务共用一个进度统计，各阶段按权重合成总进度，分阶段处理时进度也不会回退
+    progress = _work_order_progress(client, task_id, "流水线处理中" if pipeline else "正在处理",
+                                    work_order_costs(work_orders), single_pass, prefilter)
+    if pipeline:
+        _report_progress(client, task_id, 20, f"共有 {len(work_orders)} 个工单，开始流水线处理...")
+        return await run_pipeline(client, work_orders, task_id, single_pass=single_pass, checkpoint=checkpoint,
+                                  dedup=dedup, prefilter=prefilter, progress=progress)
+
+    if single_pass:
+        _report_progress(client, task_id, 20, f"共有 {len(work_orders)} 个工单，开始直接生成QA对...")
+        qa_pairs = await generate_qa_pairs_direct(client, work_orders, task_id, checkpoint, prefilter, progress)
+    else:
+        _report_progress(client, task_id, 20, f"共有 {len(work_orders)} 个工单，开始格式化对话...")
+        formatted_texts = await format_conversations(client, work_orders, task_id, checkpoint, prefilter, progress)
+        
+        # 生成QA对
+        qa_pairs = await generate_qa_pairs(client, formatted_texts, task_id, checkpoint, progress)
+    
+    # 合并近似重复的QA对后清洗（提取时已计入清洗总数）
+    unique = _deduplicate(dedup, checkpoint, qa_pairs)
+    _track_merged(progress, len(qa_pairs) - len(unique))
+    cleaned_qa = await clean_qa_pairs(client, unique, task_id, checkpoint=checkpoint, progress=progress)
+    progress.maybe_publish(force=True)
     return cleaned_qa
 
 # 将QA对保存到Excel（支持内存和文件两种模式）
 def save_to_excel(qa_pairs, output_file=None, use_memory_mode=False):
+    import pandas as pd
     if not qa_pairs:
         df = pd.DataFrame(columns=['work_order_id', 'question', 'answer'])
     else:
@@ -277,72 +915,131 @@ def save_to_excel(qa_pairs, output_file=None, use_memory_mode=False):
         logging.info(f"已将QA对保存到 {output_file}")
         return output_file
 
+# 运行协程直到完成；任务被标记为取消（cancel_requested，可能来自其他进程）时取消协程并抛出CancelledError
+async def _run_cancellable(task_id, coro, poll_interval=0.5):
+    main = asyncio.ensure_future(coro)
+    while not main.done():
+        await asyncio.wait({main}, timeout=poll_interval)
+        if not main.done() and (task_store.get(task_id) or {}).get('cancel_requested'):
+            main.cancel()
+    return await main
+
+# 将任务交给调度器排队执行
+def submit_task(task_id, file_stream, api_key, single_pass=False):
+    job_scheduler.submit(task_id, tenant_key(api_key), process_task, task_id, file_stream, api_key, True,
+                         single_pass=single_pass)
+
 # 处理任务的后台函数（支持内存处理）
-def process_task(task_id, file_input, api_key, use_memory_mode=False):
+# pipeline为True时三个阶段以流水线方式并行，为False时逐阶段完成后再进入下一阶段；
+# single_pass为True时跳过对话整理，一次调用直接提取QA对。
+# 每个工单各阶段的结果都会记录为断点，同一任务再次运行（/resume）时只处理缺失或失败的工单。
+# 读取、处理、保存各阶段的耗时（秒）记录在任务的timings中，各阶段API调用的统计记录在call_stats中
+def process_task(task_id, file_input, api_key, use_memory_mode=False, pipeline=True, single_pass=False, concurrency=None):
     if not api_key:
         api_key = os.getenv('DASHSCOPE_API_KEY')
         if not api_key:
-            task_status[task_id]['status'] = "缺少API密钥"
-            task_status[task_id]['progress'] = 100
+            task_store.update(task_id, status="缺少API密钥", progress=100, running=False)
             return
+    # 排队期间已被其他进程标记取消的任务不再运行
+    if (task_store.get(task_id) or {}).get('cancel_requested'):
+        task_store.update(task_id, status="任务已取消", progress=100, running=False, queue_position=None)
+        return
+    timings = {}
+    started = phase_start = time.perf_counter()
+    outcome = 'failed'
+
+    def finish_phase(name):
+        nonlocal phase_start
+        now = time.perf_counter()
+        timings[f"{name}_seconds"] = round(now - phase_start, 3)
+        phase_start = now
+
     try:
-        task_status[task_id]['status'] = "开始读取Excel文件..."
-        task_status[task_id]['progress'] = 0
+        task_store.update(task_id, status="开始读取Excel文件...", progress=0, running=True, queue_position=0)
         
-        # 读取Excel
-        df = read_excel(file_input)
-        if df is None:
-            task_status[task_id]['status'] = "读取Excel文件失败"
-            task_status[task_id]['progress'] = 100
+        # 流式读取Excel并按工单ID分组
+        work_orders = read_work_orders(file_input)
+        if work_orders is None:
+            task_store.update(task_id, status="读取Excel文件失败", progress=100)
             return
+        # 各工单的估算token数：决定处理顺序（大工单优先），合计值在状态中返回
+        costs = work_order_costs(work_orders)
+        task_store.update(task_id, estimated_tokens=sum(costs.values()),
+                          largest_work_order_tokens=max(costs.values(), default=0))
+        finish_phase('read')
         
-        task_status[task_id]['status'] = "正在分组工单数据..."
-        task_status[task_id]['progress'] = 10
+        # 格式化、提取、清洗三个阶段
+        checkpoint = TaskCheckpoint(task_id, get_fingerprint_store(), fingerprint_namespace(api_key, single_pass))
+        from dedup import QADeduplicator, QA_DEDUP_THRESHOLD
+        dedup = QADeduplicator() if QA_DEDUP_THRESHOLD > 0 else None
+        prefilter = WorkOrderFilter()
+        cleaned_qa = asyncio.run(_run_cancellable(task_id, process_work_orders(
+            api_key, work_orders, task_id, pipeline=pipeline, concurrency=concurrency,
+            single_pass=single_pass, checkpoint=checkpoint, dedup=dedup, prefilter=prefilter
+        )))
+        finish_phase('process')
         
-        # 按工单ID分组
-        work_orders = group_by_work_order(df)
+        task_store.update(task_id, status="正在保存结果...", progress=90)
         
-        task_status[task_id]['status'] = f"共有 {len(work_orders)} 个工单，开始格式化对话..."
-        task_status[task_id]['progress'] = 20
-        formatted_texts = format_conversations(api_key, work_orders, task_id)
-        
-        task_status[task_id]['status'] = f"格式化完成，开始生成QA对..."
-        task_status[task_id]['progress'] = 50
-        
-        # 生成QA对
-        qa_pairs = generate_qa_pairs(api_key, formatted_texts, task_id)
-        
-        task_status[task_id]['status'] = "开始清洗QA对..."
-        task_status[task_id]['progress'] = 50
-        
-        # 清洗QA对
-        cleaned_qa = clean_qa_pairs(api_key, qa_pairs, task_id)
-        
-        task_status[task_id]['status'] = "正在保存结果..."
-        task_status[task_id]['progress'] = 90
-        
-        # 保存结果
-        use_memory_mode = task_status[task_id].get('use_memory_mode', False)
+        # 保存结果（QA对存入任务存储，不随任务状态一起返回）
+        task_store.set_results(task_id, 'cleaned_qa', cleaned_qa)
+        # 为本任务的结果建立检索索引；失败时不影响任务结果，首次检索时会重新建立
+        try:
+            from search_index import build_index
+            build_index(task_store, task_id, 'cleaned_qa')
+        except Exception as e:
+            logging.warning(f"任务 {task_id} 建立检索索引失败: {e}")
+        use_memory_mode = use_memory_mode or (task_store.get(task_id) or {}).get('use_memory_mode', False)
         
         if use_memory_mode:
             # 内存模式：不存储bytes数据，只在下载时重新生成
-            task_status[task_id]['result_file'] = None
+            result_file = None
         else:
             # 文件模式：保存到磁盘
-            output_file = os.path.join(RESULT_FOLDER, f"{task_id}_cleaned_qa_pairs.xlsx")
-            save_to_excel(cleaned_qa, output_file)
-            task_status[task_id]['result_file'] = output_file
+            result_file = os.path.join(RESULT_FOLDER, f"{task_id}_cleaned_qa_pairs.xlsx")
+            save_to_excel(cleaned_qa, result_file)
+        finish_phase('save')
         
         # 更新任务状态
-        task_status[task_id]['status'] = f"处理完成！共生成 {len(cleaned_qa)} 个清洗后QA对"
-        task_status[task_id]['progress'] = 100
-        task_status[task_id]['qa_count'] = len(cleaned_qa)
-        task_status[task_id]['cleaned_qa'] = cleaned_qa  # 临时存储以供显示
+        deduplicated = dedup.duplicates if dedup else 0
+        status = f"处理完成！共生成 {len(cleaned_qa)} 个清洗后QA对"
+        if deduplicated:
+            status += f"（已合并 {deduplicated} 个近似重复QA对）"
+        if prefilter.skipped_total:
+            status += f"，跳过 {prefilter.skipped_total} 个没有有效内容的工单"
+        # 复用率：内容与之前上传过的工单相同、直接使用之前结果的工单所占比例
+        reuse_ratio = round(checkpoint.reused_count / len(work_orders), 4) if work_orders else 0
+        if checkpoint.reused_count:
+            status += f"，{checkpoint.reused_count} 个未变化的工单复用了之前的结果（复用率 {reuse_ratio:.1%}）"
+        if checkpoint.failed:
+            status += f"，{len(checkpoint.failed)} 个工单处理失败，可继续处理失败的工单"
+        task_store.update(
+            task_id,
+            status=status,
+            progress=100,
+            qa_count=len(cleaned_qa),
+            result_file=result_file,
+            failed_work_orders=len(checkpoint.failed),
+            restored_work_orders=checkpoint.restored_count,
+            reused_work_orders=checkpoint.reused_count,
+            reuse_ratio=reuse_ratio,
+            deduplicated_qa=deduplicated,
+            skipped_work_orders=dict(prefilter.skipped)
+        )
+        outcome = 'completed'
         
+    except asyncio.CancelledError:
+        # 已完成的工单保留断点，之后可以通过 /resume 继续
+        logging.info(f"任务 {task_id} 已取消")
+        task_store.update(task_id, status="任务已取消", progress=100)
+        outcome = 'cancelled'
     except Exception as e:
         logging.error(f"处理任务出错: {e}")
-        task_status[task_id]['status'] = f"处理过程中发生错误: {str(e)}"
-        task_status[task_id]['progress'] = 100
+        task_store.update(task_id, status=f"处理过程中发生错误: {str(e)}", progress=100)
+    finally:
+        timings['total_seconds'] = round(time.perf_counter() - started, 3)
+        TASKS.inc(outcome=outcome)
+        task_store.update(task_id, running=False, timings=timings, eta_seconds=None)
 
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
@@ -359,6 +1056,7 @@ def upload_file():
             if not api_key:
                 flash('API密钥是必需的。')
                 return redirect(request.url)
+            single_pass = form_flag('single_pass')
             task_id = str(uuid.uuid4())
             
             # 强制使用内存模式 - 直接读取文件内容到内存
@@ -366,16 +1064,18 @@ def upload_file():
             file_content = file.read()
             file_stream = BytesIO(file_content)
             
-            task_status[task_id] = {
-                'status': '任务已创建',
-                'progress': 0,
-                'result_file': None,
-                'qa_count': 0,
-                'use_memory_mode': True
-            }
-            thread = threading.Thread(target=process_task, args=(task_id, file_stream, api_key, True))
-            thread.daemon = True
-            thread.start()
+            task_store.create(
+                task_id,
+                status='任务已创建',
+                progress=0,
+                result_file=None,
+                qa_count=0,
+                use_memory_mode=True,
+                single_pass=single_pass,
+                running=True
+            )
+            task_store.save_upload(task_id, file_content)
+            submit_task(task_id, file_stream, api_key, single_pass)
             return redirect(url_for('show_status', task_id=task_id))
     return render_template('index.html')
 
@@ -394,6 +1094,7 @@ def upload_file_new():
     
     file = request.files['file']
     api_key = request.form.get('api_key', '').strip()
+    single_pass = form_flag('single_pass')
     
     if file.filename == '':
         return jsonify({'error': '没有选择文件'}), 400
@@ -413,52 +1114,189 @@ def upload_file_new():
     file_stream = BytesIO(file_content)
     
     # 初始化任务状态
-    task_status[task_id] = {
-        'status': '任务已创建',
-        'progress': 0,
-        'result_file': None,
-        'qa_count': 0,
-        'use_memory_mode': True
-    }
+    task_store.create(
+        task_id,
+        status='任务已创建',
+        progress=0,
+        result_file=None,
+        qa_count=0,
+        use_memory_mode=True,
+        single_pass=single_pass,
+        running=True
+    )
+    # 保存原始文件，任务中断后可通过 /resume 继续处理
+    task_store.save_upload(task_id, file_content)
     
-    # 在后台线程中处理任务
-    thread = threading.Thread(target=process_task, args=(task_id, file_stream, api_key, True))
-    thread.daemon = True
-    thread.start()
+    # 交给调度器排队处理
+    submit_task(task_id, file_stream, api_key, single_pass)
     
     return jsonify({
         'task_id': task_id,
         'message': '文件上传成功，开始处理...'
     })
 
+# 继续处理中断或部分失败的任务：已完成的工单和阶段直接使用断点，只处理缺失或失败的工单。
+# 默认使用上传时保存的原始文件，也可以重新上传同一文件
+@app.route('/resume/<task_id>', methods=['POST'])
+def resume_task(task_id):
+    task = task_store.get(task_id)
+    if task is None:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    api_key = request.form.get('api_key', '').strip()
+    if not api_key:
+        return jsonify({'error': '请输入API密钥'}), 400
+    
+    # 仍有进程在更新的任务不能重复启动；长时间没有更新说明处理进程已中断
+    if task_id in job_scheduler.positions() or job_scheduler.is_running(task_id) or (
+            task.get('running') and time.time() - task['updated_at'] < TASK_RESUME_STALE_SECONDS):
+        return jsonify({'error': '任务正在处理中'}), 409
+    
+    file = request.files.get('file')
+    if file and file.filename:
+        if not allowed_file(file.filename):
+            return jsonify({'error': '只支持Excel文件格式 (.xlsx, .xls)'}), 400
+        file_content = file.read()
+        task_store.save_upload(task_id, file_content)
+    else:
+        file_content = task_store.get_upload(task_id)
+        if file_content is None:
+            return jsonify({'error': '原始文件不存在，请重新上传'}), 400
+    
+    from io import BytesIO
+    task_store.update(task_id, status='任务已恢复，继续处理...', progress=0, running=True, cancel_requested=False)
+    submit_task(task_id, BytesIO(file_content), api_key, task.get('single_pass', False))
+    
+    return jsonify({
+        'task_id': task_id,
+        'message': '任务已恢复，只处理未完成的工单...'
+    })
+
+# 取消任务：排队中的任务直接移出队列，运行中的任务在当前请求结束后停止（已完成的工单保留断点）
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel_task(task_id):
+    task = task_store.get(task_id)
+    if task is None:
+        return jsonify({'error': '任务不存在'}), 404
+    if not task.get('running'):
+        return jsonify({'error': '任务已结束'}), 409
+    
+    task_store.update(task_id, cancel_requested=True)
+    if job_scheduler.cancel(task_id):
+        task_store.update(task_id, status='任务已取消', progress=100, running=False, queue_position=None)
+    
+    return jsonify({'task_id': task_id, 'message': '任务已取消'})
+
+# 格式化一条SSE消息
+def _sse_message(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# 任务进度推送（Server-Sent Events）：连接后先推送完整状态，之后只推送发生变化的字段，
+# 任务结束时发送done事件并关闭连接；连接超过SSE_MAX_STREAM_SECONDS时也会关闭，由浏览器重连。
+# 任务状态从任务存储读取，处理任务的可以是其他进程
+@app.route('/events/<task_id>')
+def task_events(task_id):
+    if task_id not in task_store:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    def stream():
+        sent = {}
+        last_message = opened = time.monotonic()
+        yield "retry: 2000\n\n"
+        while time.monotonic() - opened < SSE_MAX_STREAM_SECONDS:
+            task = task_store.get(task_id)
+            if task is None:
+                yield _sse_message({'error': '任务不存在'}, 'gone')
+                return
+            task.pop('updated_at', None)
+            changed = {key: value for key, value in task.items() if key not in sent or sent[key] != value}
+            if changed:
+                sent.update(changed)
+                yield _sse_message(changed)
+                last_message = time.monotonic()
+            if not task.get('running') and task.get('progress') == 100:
+                yield _sse_message({}, 'done')
+                return
+            if time.monotonic() - last_message >= SSE_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_message = time.monotonic()
+            time.sleep(SSE_POLL_INTERVAL)
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/status/<task_id>')
 def get_status(task_id):
-    if task_id not in task_status:
+    task = task_store.get(task_id)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    return jsonify(task_status[task_id])
+    return jsonify(task)
+
+# 在任务的清洗结果中检索与 ?q= 最相似的QA对，?k= 指定返回数量（默认10，最多100）
+@app.route('/search/<task_id>')
+def search_qa(task_id):
+    if task_id not in task_store:
+        return jsonify({'error': '任务不存在'}), 404
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '请输入检索内容'}), 400
+    k = request.args.get('k', 10, type=int)
+    if k < 1:
+        return jsonify({'error': 'k必须是正整数'}), 400
+    from search_index import search as search_results
+    start = time.perf_counter()
+    hits = search_results(task_store, task_id, query, min(k, 100))
+    if hits is None:
+        return jsonify({'error': '结果数据不存在'}), 404
+    return jsonify({
+        'task_id': task_id,
+        'query': query,
+        'results': [dict(qa, score=round(score, 4)) for score, qa in hits],
+        'took_ms': round((time.perf_counter() - start) * 1000, 2)
+    })
+
+# Prometheus格式的进程内指标：LLM调用次数、耗时分布、重试、超时、token用量，各阶段吞吐量、队列深度和任务数
+@app.route('/metrics')
+def metrics():
+    depths = {}
+    with _pipeline_queues_lock:
+        for name, queue in _pipeline_queues.values():
+            depths[name] = depths.get(name, 0) + queue.qsize()
+    for name in ('format', 'extract', 'clean'):
+        QUEUE_DEPTH.set(depths.get(name, 0), stage=name)
+    JOBS.set(len(job_scheduler.positions()), state='queued')
+    JOBS.set(job_scheduler.running_count(), state='running')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# 下载任务的一组结果，格式由 ?format= 指定（xlsx、csv、jsonl，默认xlsx）。
+# 导出文件逐行生成并按任务缓存，结果集不变时重复下载直接发送缓存文件
+def send_results(task_id, name, download_name, missing_error):
+    fmt = request.args.get('format', 'xlsx').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'不支持的导出格式: {fmt}'}), 400
+    path = export_results(task_store, task_id, name, fmt)
+    if path is None:
+        return jsonify({'error': missing_error}), 404
+    return send_file(
+        path,
+        as_attachment=True,
+        download_name=f"{download_name}_{task_id}.{fmt}",
+        mimetype=EXPORT_FORMATS[fmt]
+    )
 
 @app.route('/download/<task_id>')
 def download_result(task_id):
-    if task_id not in task_status:
+    task = task_store.get(task_id)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    task = task_status[task_id]
     use_memory_mode = task.get('use_memory_mode', False)
     
     if use_memory_mode:
-        # 内存模式：重新生成Excel文件
-        if 'cleaned_qa' not in task:
-            return jsonify({'error': '结果数据不存在'}), 404
-        
-        from io import BytesIO
-        result_data = save_to_excel(task['cleaned_qa'], use_memory_mode=True)
-        return send_file(
-            result_data,
-            as_attachment=True,
-            download_name=f"qa_pairs_{task_id}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        # 内存模式：从任务存储逐行导出，导出文件按任务缓存
+        return send_results(task_id, 'cleaned_qa', 'qa_pairs', '结果数据不存在')
     else:
         # 文件模式：从磁盘读取
         if not task.get('result_file') or not os.path.exists(task['result_file']):
@@ -472,53 +1310,37 @@ def download_result(task_id):
 
 @app.route('/result/<task_id>', methods=['GET'])
 def show_cleaned_result(task_id):
-    if task_id not in task_status:
+    if task_id not in task_store:
         flash('任务不存在')
         return redirect(url_for('upload_file'))
-    task = task_status[task_id]
-    if 'cleaned_qa' not in task:
+    qa_data = task_store.get_results(task_id, 'cleaned_qa')
+    if qa_data is None:
         flash('清洗结果不可用')
         return redirect(url_for('upload_file'))
-    qa_data = task['cleaned_qa']
     return render_template('result.html', qa_data=qa_data, task_id=task_id)
 
 @app.route('/submit_selection/<task_id>', methods=['POST'])
 def submit_selection(task_id):
-    if task_id not in task_status:
+    if task_id not in task_store:
         return jsonify({'error': '任务不存在'}), 404
     
     selected_indices = request.form.getlist('selected')
-    cleaned_qa = task_status[task_id]['cleaned_qa']
-    final_qa = [cleaned_qa[int(idx)] for idx in selected_indices if idx.isdigit()]
-    
-    use_memory_mode = task_status[task_id].get('use_memory_mode', False)
+    cleaned_qa = task_store.get_results(task_id, 'cleaned_qa') or []
+    final_qa = [cleaned_qa[int(idx)] for idx in selected_indices if idx.isdigit() and int(idx) < len(cleaned_qa)]
     
     # 不存储bytes数据，只在下载时重新生成
-    task_status[task_id]['final_qa'] = final_qa
-    task_status[task_id]['final_file'] = None
+    task_store.set_results(task_id, 'final_qa', final_qa)
+    task_store.update(task_id, final_file=None)
     
     return jsonify({'message': '筛选完成', 'download_url': url_for('download_final', task_id=task_id)})
 
 @app.route('/download_final/<task_id>')
 def download_final(task_id):
-    if task_id not in task_status:
+    if task_id not in task_store:
         return jsonify({'error': '任务不存在'}), 404
     
-    task = task_status[task_id]
-    use_memory_mode = task_status[task_id].get('use_memory_mode', False)
-    
-    # 内存模式：重新生成Excel文件
-    if 'final_qa' not in task:
-        return jsonify({'error': '最终数据不存在'}), 404
-    
-    from io import BytesIO
-    final_data = save_to_excel(task['final_qa'], use_memory_mode=True)
-    return send_file(
-        final_data,
-        as_attachment=True,
-        download_name=f"final_qa_pairs_{task_id}.xlsx",
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+    # 筛选结果变化后会重新生成导出文件
+    return send_results(task_id, 'final_qa', 'final_qa_pairs', '最终数据不存在')
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -0,0 +1,162 @@
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import app
+from dedup import QADeduplicator, QA_DEDUP_THRESHOLD
+from prefilter import WorkOrderFilter
+from fingerprint_store import get_fingerprint_store
+from export import rag_record
+from llm_client import AsyncDashScopeClient
+
+# 不经过网页的批量处理：与网页端使用同一套处理流程（app.py），多个工单表同时处理，共用一个客户端的并发上限和限流。
+# 每个工单表处理完成后立即以JSONL写入输出文件：近似重复的QA对要到整个文件去重结束才能确定合并到哪个代表
+# （duplicate_work_order_ids），因此按文件写入；处理大量积压文件时内存占用不随文件数量增长。
+#
+#   python batch.py exports/ -o qa_pairs.jsonl
+#   python batch.py "exports/2024-*.xlsx" -o - --concurrency 30 > qa_pairs.jsonl
+
+# 同时处理的工单表数量
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '4'))
+
+
+# 展开输入：目录取其中所有Excel文件（含子目录），含通配符的按glob匹配，其余视为文件路径
+def expand_inputs(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, '**', '*'), recursive=True)
+        elif glob.has_magic(item):
+            matches = glob.glob(item, recursive=True)
+        else:
+            matches = [item]
+        for path in sorted(matches):
+            # 跳过Excel打开文件时生成的 ~$ 锁文件
+            if os.path.basename(path).startswith('~$') or not app.allowed_file(os.path.basename(path)):
+                continue
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+# 每个工单表的结果逐行写入输出（JSONL，字段同 /download?format=jsonl，另加来源文件名 source_file）
+class JsonlWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def write(self, source_file, qa_pairs):
+        for qa in qa_pairs:
+            self.stream.write(json.dumps(dict(rag_record(qa), source_file=source_file), ensure_ascii=False) + '\n')
+        self.count += len(qa_pairs)
+        self.stream.flush()
+
+
+# 处理单个工单表，返回统计信息。每个文件使用一个临时任务记录进度和断点，处理结束后删除
+async def process_file(client, path, writer, pipeline=True, single_pass=False):
+    task_id = f"batch-{uuid.uuid4()}"
+    stats = {'file': path, 'work_orders': 0, 'qa_pairs': 0, 'skipped': 0, 'reused': 0, 'failed': 0,
+             'deduplicated': 0, 'seconds': 0.0, 'error': None}
+    start = time.perf_counter()
+    app.task_store.create(task_id, status="开始读取Excel文件...", progress=0, running=True)
+    try:
+        work_orders = await asyncio.to_thread(app.read_work_orders, path)
+        if work_orders is None:
+            stats['error'] = "读取Excel文件失败"
+            return stats
+        stats['work_orders'] = len(work_orders)
+
+        checkpoint = app.TaskCheckpoint(task_id, get_fingerprint_store(),
+                                        app.fingerprint_namespace(client.api_key, single_pass))
+        dedup = QADeduplicator() if QA_DEDUP_THRESHOLD > 0 else None
+        prefilter = WorkOrderFilter()
+        cleaned_qa = await app.process_work_orders_with_client(client, work_orders, task_id, pipeline, single_pass,
+                                                               checkpoint, dedup, prefilter)
+        writer.write(path, cleaned_qa)
+        stats.update(qa_pairs=len(cleaned_qa), skipped=prefilter.skipped_total, reused=checkpoint.reused_count,
+                     failed=len(checkpoint.failed), deduplicated=dedup.duplicates if dedup else 0)
+    except Exception as e:
+        logging.error(f"处理 {path} 出错: {e}")
+        stats['error'] = str(e)
+    finally:
+        stats['seconds'] = round(time.perf_counter() - start, 3)
+        app.task_store.delete(task_id)
+    return stats
+
+
+# 同时处理多个工单表（最多max_files个），所有文件共用一个客户端，总并发不超过concurrency。
+# output为文件路径或可写的文本流，返回每个文件的统计信息
+async def process_files_async(paths, api_key, output, concurrency=None, max_files=None, pipeline=True,
+                              single_pass=False):
+    semaphore = asyncio.Semaphore(max_files or BATCH_MAX_FILES)
+
+    async def run(client, writer, path):
+        async with semaphore:
+            stats = await process_file(client, path, writer, pipeline, single_pass)
+            logging.info(f"{path}: {stats}")
+            return stats
+
+    stream = open(output, 'w', encoding='utf-8') if isinstance(output, str) else output
+    try:
+        writer = JsonlWriter(stream)
+        async with AsyncDashScopeClient(api_key, concurrency=concurrency) as client:
+            return await asyncio.gather(*(run(client, writer, path) for path in paths))
+    finally:
+        if stream is not output:
+            stream.close()
+
+
+def process_files(paths, api_key, output, **options):
+    return asyncio.run(process_files_async(paths, api_key, output, **options))
+
+
+def _print_stats(results, elapsed, file=sys.stderr):
+    print(f"{'work_orders':>11} {'qa_pairs':>8} {'skipped':>7} {'reused':>6} {'failed':>6} {'seconds':>8}  file", file=file)
+    for stats in results:
+        print(f"{stats['work_orders']:>11,} {stats['qa_pairs']:>8,} {stats['skipped']:>7,} {stats['reused']:>6,} "
+              f"{stats['failed']:>6,} {stats['seconds']:>8.1f}  {stats['file']}"
+              + (f"  错误: {stats['error']}" if stats['error'] else ''), file=file)
+    total_qa = sum(stats['qa_pairs'] for stats in results)
+    print(f"共 {len(results)} 个文件，{total_qa:,} 个QA对，耗时 {elapsed:.1f}s", file=file)
+
+
+# 命令行入口。有文件读取失败或有工单处理失败时退出码为1
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量处理工单表（目录、通配符或文件路径），QA对以JSONL逐个文件写入输出文件")
+    parser.add_argument('inputs', nargs='+', help="工单表文件、目录或通配符（如 \"exports/*.xlsx\"）")
+    parser.add_argument('-o', '--output', default='qa_pairs.jsonl', help="输出的JSONL文件，- 为标准输出")
+    parser.add_argument('--api-key', default=os.getenv('DASHSCOPE_API_KEY'), help="默认使用环境变量DASHSCOPE_API_KEY")
+    parser.add_argument('--concurrency', type=int, help="所有文件合计的最大并发请求数（默认使用LLM_CONCURRENCY）")
+    parser.add_argument('--max-files', type=int, default=BATCH_MAX_FILES, help="同时处理的文件数")
+    parser.add_argument('--single-pass', action='store_true', help="单次调用模式：直接从原始消息提取QA对")
+    parser.add_argument('--staged', action='store_true', help="按阶段处理（默认流水线）")
+    parser.add_argument('--stats', help="将每个文件的统计信息以JSON写入该文件")
+    parser.add_argument('-q', '--quiet', action='store_true', help="只输出警告和错误日志")
+    args = parser.parse_args(argv)
+
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+    if not args.api_key:
+        parser.error("缺少API密钥：使用 --api-key 或设置环境变量DASHSCOPE_API_KEY")
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error("没有找到Excel文件（.xlsx、.xls）")
+
+    start = time.perf_counter()
+    output = sys.stdout if args.output == '-' else args.output
+    results = process_files(paths, args.api_key, output, concurrency=args.concurrency, max_files=args.max_files,
+                            pipeline=not args.staged, single_pass=args.single_pass)
+    _print_stats(results, time.perf_counter() - start)
+    if args.stats:
+        with open(args.stats, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 1 if any(stats['error'] or stats['failed'] for stats in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from llm_client import AsyncDashScopeClient
+from mock_dashscope import start_mock_server
+
+
+def make_qa_pairs(count):
+    return [
+        {
+            'work_order_id': 100000 + index // 3,
+            'question': f"设备{index}号开机后屏幕无显示，指示灯闪烁，如何处理？",
+            'answer': f"先检查设备{index}号的电源适配器和显示线缆，确认无误后重置主板，仍无法解决则更换显示模块。",
+        }
+        for index in range(count)
+    ]
+
+
+# 在本地模拟服务上用指定批大小清洗QA对，返回请求数、token用量和耗时
+async def run_once(qa_pairs, batch_size, latency, concurrency):
+    runner, base_url, stats = await start_mock_server(latency=latency, jitter=latency / 4)
+    try:
+        task_id = f"bench-{batch_size}"
+        app.task_store.create(task_id)
+        async with AsyncDashScopeClient('bench', concurrency=concurrency, base_url=base_url, cache=False) as client:
+            start = time.perf_counter()
+            cleaned = await app.clean_qa_pairs(client, qa_pairs, task_id, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+        return dict(stats, elapsed=elapsed, cleaned=len(cleaned))
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比逐条验证与批量验证QA对的请求数、token用量和耗时")
+    parser.add_argument('--pairs', type=int, default=2000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 5, 10, 20])
+    parser.add_argument('--latency', type=float, default=0.3, help="模拟服务的平均响应延迟（秒）")
+    parser.add_argument('--concurrency', type=int, default=15)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    qa_pairs = make_qa_pairs(args.pairs)
+    print(f"{'batch':>6} {'requests':>9} {'prompt tok':>11} {'output tok':>11} {'seconds':>8} {'ms/pair':>8} {'kept':>6}")
+    for batch_size in args.batch_sizes:
+        result = asyncio.run(run_once(qa_pairs, batch_size, args.latency, args.concurrency))
+        print(f"{batch_size:>6} {result['requests']:>9,} {result['prompt_tokens']:>11,} {result['completion_tokens']:>11,} "
+              f"{result['elapsed']:>8.2f} {result['elapsed'] * 1000 / args.pairs:>8.2f} {result['cleaned']:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from dedup import QADeduplicator
+from llm_client import AsyncDashScopeClient
+from mock_dashscope import start_mock_server
+
+FAULTS = ['开机后屏幕无显示', '网络连接频繁中断', '打印机卡纸', '系统提示磁盘空间不足', '风扇噪音很大',
+          '无法登录管理后台', '电池无法充电', '触摸屏失灵', '蓝牙无法配对', '升级固件后反复重启']
+PREFIXES = ['', '请问', '您好，', '麻烦问下，']
+SUFFIXES = ['怎么办？', '如何处理？', '该怎么解决？', '要怎么排查？']
+
+
+# 生成含大量重复故障的QA对：每条问题由一种故障加上随机的称呼、设备编号和问法组成，
+# unique_ratio为完全不同的问题所占比例
+def make_qa_pairs(count, unique_ratio, seed=0):
+    rng = random.Random(seed)
+    qa_pairs = []
+    for index in range(count):
+        if rng.random() < unique_ratio:
+            question = f"工单{index}中的设备{rng.randrange(10 ** 6)}出现了第{index}类罕见故障，怎么处理？"
+        else:
+            question = f"{rng.choice(PREFIXES)}{rng.choice(FAULTS)}{rng.choice(SUFFIXES)}"
+        qa_pairs.append({'work_order_id': 100000 + index // 3, 'question': question, 'answer': '按标准流程排查处理。'})
+    return qa_pairs
+
+
+async def clean_requests(qa_pairs, latency, concurrency):
+    runner, base_url, stats = await start_mock_server(latency=latency, jitter=latency / 4)
+    try:
+        app.task_store.create('bench-dedup')
+        async with AsyncDashScopeClient('bench', concurrency=concurrency, base_url=base_url, cache=False) as client:
+            start = time.perf_counter()
+            await app.clean_qa_pairs(client, qa_pairs, 'bench-dedup')
+            return stats['requests'], time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量QA对近似去重的耗时，以及去重前后清洗阶段的请求数")
+    parser.add_argument('--pairs', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--unique-ratio', type=float, default=0.1, help="完全不同的问题所占比例")
+    parser.add_argument('--clean-pairs', type=int, default=2000, help="实际调用模拟服务清洗的QA对数量，0为不测")
+    parser.add_argument('--latency', type=float, default=0.3, help="模拟服务的平均响应延迟（秒）")
+    parser.add_argument('--concurrency', type=int, default=15)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print(f"{'pairs':>9} {'kept':>8} {'merged':>8} {'seconds':>8} {'us/pair':>8}")
+    for count in args.pairs:
+        qa_pairs = make_qa_pairs(count, args.unique_ratio)
+        start = time.perf_counter()
+        unique, duplicates = QADeduplicator().split(qa_pairs)
+        elapsed = time.perf_counter() - start
+        print(f"{count:>9,} {len(unique):>8,} {len(duplicates):>8,} {elapsed:>8.2f} {elapsed * 1e6 / count:>8.1f}")
+
+    if args.clean_pairs:
+        qa_pairs = make_qa_pairs(args.clean_pairs, args.unique_ratio)
+        unique, _ = QADeduplicator().split(qa_pairs)
+        print(f"\n{'clean':>9} {'pairs':>8} {'requests':>9} {'seconds':>8}")
+        for label, pairs in (('no dedup', qa_pairs), ('dedup', unique)):
+            requests, elapsed = asyncio.run(clean_requests(pairs, args.latency, args.concurrency))
+            print(f"{label:>9} {len(pairs):>8,} {requests:>9,} {elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
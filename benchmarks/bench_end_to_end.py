@@ -0,0 +1,241 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from openpyxl import Workbook
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FAULTS = ['开机后屏幕无显示', '网络连接频繁中断', '打印机卡纸', '系统提示磁盘空间不足', '风扇噪音很大',
+          '无法登录管理后台', '电池无法充电', '触摸屏失灵', '蓝牙无法配对', '升级固件后反复重启']
+SOLUTIONS = ['更换电源模块后恢复正常', '重置网络配置并更换网线', '清理进纸通道并更换搓纸轮', '清理日志文件并扩容磁盘',
+             '清洁风扇并更换轴承', '重置管理员密码', '更换电池和充电接口', '重新校准触摸屏', '升级蓝牙驱动', '回退固件版本']
+ACKNOWLEDGEMENTS = ['好的', '谢谢', '收到']
+
+
+# 生成符合上传格式（work_order_id/created_at/content/oa_user_name）的合成工单表，返回总行数。
+# 每个工单的消息数服从均值为mean_messages的帕累托分布，skew（需大于1）越小长度越偏斜，0为所有工单长度相同；
+# trivial_ratio为只有一条寒暄消息的工单比例。行按工单ID连续排列（系统导出的默认顺序），shuffle为True时打乱
+def make_workbook(path, work_orders, mean_messages=8, skew=1.5, max_messages=400, trivial_ratio=0.05,
+                  shuffle=False, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for index in range(work_orders):
+        work_id = 100000 + index
+        if rng.random() < trivial_ratio:
+            rows.append((work_id, 0, rng.choice(ACKNOWLEDGEMENTS), '客户'))
+            continue
+        count = mean_messages
+        if skew > 1:
+            count = int(mean_messages * (skew - 1) / skew * rng.paretovariate(skew))
+        count = max(2, min(max_messages, count))
+        fault = rng.randrange(len(FAULTS))
+        for turn in range(count):
+            if turn % 2 == 0:
+                content = f"客户反馈设备{rng.randrange(10 ** 4)}号{FAULTS[fault]}，第{turn // 2 + 1}次联系"
+                user = '客户'
+            else:
+                content = f"工程师检查后{SOLUTIONS[fault]}，请确认设备状态"
+                user = '客服小王'
+            rows.append((work_id, turn, content, user))
+    if shuffle:
+        rng.shuffle(rows)
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['work_order_id', 'created_at', 'content', 'oa_user_name'])
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return len(rows)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# 在子进程中启动模拟服务（不计入被测进程的内存），返回 (进程, base_url)
+def start_mock_process(options):
+    port = _free_port()
+    command = [sys.executable, os.path.join(BENCH_DIR, 'mock_dashscope.py'), '--port', str(port)] + options
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            requests.get(f"{base_url}/stats", timeout=1)
+            return process, base_url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("模拟服务启动超时")
+
+
+# 当前进程的常驻内存（MB）；没有/proc时使用进程内存峰值
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+# 后台线程定期采样内存，记录峰值
+class RssSampler(threading.Thread):
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+# 包装指标记录函数，同时保留每次观测的原始耗时，用于计算精确的分位数
+def _record_samples(samples, observe):
+    def wrapper(value, **labels):
+        samples.setdefault(labels.get('stage'), []).append(value)
+        return observe(value, **labels)
+    return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用合成工单表和本地模拟服务端到端运行process_task，报告吞吐量、各阶段延迟分位数和内存峰值")
+    parser.add_argument('--work-orders', type=int, default=500)
+    parser.add_argument('--mean-messages', type=int, default=8, help="每个工单的平均消息数")
+    parser.add_argument('--skew', type=float, default=1.5, help="工单长度的帕累托分布参数（大于1），越小越偏斜，0为长度相同")
+    parser.add_argument('--trivial-ratio', type=float, default=0.05, help="只有一条寒暄消息的工单比例")
+    parser.add_argument('--shuffle', action='store_true', help="打乱行顺序（同一工单的行不连续）")
+    parser.add_argument('--profile', default='fast', help="模拟服务的预设特征：fast、realistic、flaky、throttled")
+    parser.add_argument('--mock-args', default='', help="传给模拟服务的其他参数，如 \"--error-rate 0.02 --throttle-rate 0.05\"")
+    parser.add_argument('--mode', choices=['pipeline', 'staged', 'single-pass'], default='pipeline')
+    parser.add_argument('--concurrency', type=int, default=15)
+    parser.add_argument('--batch-size', type=int, help="清洗阶段每批QA对数量（默认使用QA_CLEAN_BATCH_SIZE）")
+    parser.add_argument('--max-rps', type=float, default=1000, help="客户端限流的每秒请求数上限")
+    parser.add_argument('--json', help="将报告以JSON写入该文件，便于与之前的结果比较")
+    args = parser.parse_args()
+
+    mock, base_url = start_mock_process(['--profile', args.profile] + args.mock_args.split())
+    # 配置需要在导入app之前设置：不使用回复缓存和工单指纹库，任务状态只保存在内存中
+    os.environ.update({
+        'DASHSCOPE_BASE_URL': base_url,
+        'LLM_CACHE_PATH': '',
+        'FINGERPRINT_STORE_PATH': '',
+        'TASK_STORE_PATH': '',
+        'LLM_MAX_RPS': str(args.max_rps),
+        'LLM_MAX_TPM': str(10 ** 9),
+    })
+    if args.batch_size:
+        os.environ['QA_CLEAN_BATCH_SIZE'] = str(args.batch_size)
+    import app
+    import metrics
+    # 注入的错误会产生大量错误日志，报告中已有统计
+    logging.disable(logging.ERROR)
+
+    stage_samples, call_samples = {}, {}
+    metrics.STAGE_SECONDS.observe = _record_samples(stage_samples, metrics.STAGE_SECONDS.observe)
+    metrics.LLM_REQUEST_SECONDS.observe = _record_samples(call_samples, metrics.LLM_REQUEST_SECONDS.observe)
+
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, 'work_orders.xlsx')
+            rows = make_workbook(path, args.work_orders, args.mean_messages, args.skew,
+                                 trivial_ratio=args.trivial_ratio, shuffle=args.shuffle)
+
+            task_id = 'bench-end-to-end'
+            app.task_store.create(task_id)
+            sampler = RssSampler()
+            baseline_rss = sampler.peak
+            sampler.start()
+            start = time.perf_counter()
+            app.process_task(task_id, path, 'bench', use_memory_mode=True, pipeline=args.mode != 'staged',
+                             single_pass=args.mode == 'single-pass', concurrency=args.concurrency)
+            elapsed = time.perf_counter() - start
+            sampler.stop()
+        mock_stats = requests.get(f"{base_url}/stats", timeout=5).json()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    task = app.task_store.get(task_id)
+    retries = {}
+    for (model, reason), count in metrics.LLM_RETRIES.values().items():
+        retries[reason] = retries.get(reason, 0) + count
+    report = {
+        'work_orders': args.work_orders,
+        'rows': rows,
+        'mode': args.mode,
+        'profile': args.profile,
+        'status': task.get('status'),
+        'qa_count': task.get('qa_count'),
+        'seconds': round(elapsed, 3),
+        'work_orders_per_second': round(args.work_orders / elapsed, 2),
+        'rows_per_second': round(rows / elapsed, 1),
+        'requests': mock_stats['requests'],
+        'injected_errors': mock_stats['errors'],
+        'injected_throttles': mock_stats['throttled'],
+        'retries': retries,
+        'failed_work_orders': task.get('failed_work_orders'),
+        'baseline_rss_mb': round(baseline_rss, 1),
+        'peak_rss_mb': round(sampler.peak, 1),
+        'stages': {
+            stage: {
+                'items': len(stage_samples.get(stage, [])),
+                'p50': percentile(stage_samples.get(stage), 0.5),
+                'p99': percentile(stage_samples.get(stage), 0.99),
+                'calls': len(call_samples.get(stage, [])),
+                'call_p50': percentile(call_samples.get(stage), 0.5),
+                'call_p99': percentile(call_samples.get(stage), 0.99),
+            }
+            for stage in ('format', 'extract', 'clean') if stage in stage_samples or stage in call_samples
+        },
+        'timings': task.get('timings'),
+    }
+
+    print(report['status'])
+    print(f"工单 {args.work_orders:,} 个（{rows:,} 行），模式 {args.mode}，模拟服务 {args.profile}")
+    print(f"耗时 {elapsed:.2f}s，{report['work_orders_per_second']} 工单/s，{report['rows_per_second']} 行/s，"
+          f"请求 {report['requests']:,} 次（注入错误 {report['injected_errors']}，限流 {report['injected_throttles']}），重试 {retries}")
+    print(f"内存 基线 {report['baseline_rss_mb']} MB，峰值 {report['peak_rss_mb']} MB")
+    print(f"{'stage':>8} {'items':>7} {'p50 s':>8} {'p99 s':>8} {'calls':>7} {'call p50':>9} {'call p99':>9}")
+    for stage, row in report['stages'].items():
+        cells = [f"{row[key]:.3f}" if row[key] is not None else '-' for key in ('p50', 'p99', 'call_p50', 'call_p99')]
+        print(f"{stage:>8} {row['items']:>7} {cells[0]:>8} {cells[1]:>8} {row['calls']:>7} {cells[2]:>9} {cells[3]:>9}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
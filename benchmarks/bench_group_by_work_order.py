@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import group_messages
+
+
+# 原先基于df.iterrows()的分组实现，作为对照基线
+def legacy_group_by_work_order(df):
+    work_orders = defaultdict(list)
+    df = df.sort_values(by=['work_order_id', 'created_at'])
+    for _, row in tqdm(df.iterrows(), total=len(df), desc="分组工单数据", disable=True):
+        work_id = row['work_order_id']
+        content = row['content']
+        user_name = row['oa_user_name']
+        if pd.isna(content) or content.strip() == '' or pd.isna(user_name):
+            continue
+        work_orders[work_id].append({
+            'user': user_name,
+            'content': content
+        })
+    return work_orders
+
+
+# 生成合成工单数据：每个工单平均messages_per_order条消息，含空内容和AI回复
+def make_frame(rows, messages_per_order=20, seed=0):
+    rng = np.random.default_rng(seed)
+    n_orders = max(1, rows // messages_per_order)
+    work_ids = rng.integers(100000, 100000 + n_orders, size=rows)
+    # 时间戳互不相同，避免不稳定排序导致两种实现的消息顺序不可比
+    created_at = pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.permutation(rows), unit='s')
+    vocab = np.array(['设备无法开机', '已派工程师上门检查', '更换电源模块后恢复正常', '请提供设备序列号', '好的，谢谢', ' ', '网络连接中断'], dtype=object)
+    content = vocab[rng.integers(0, len(vocab), size=rows)]
+    content[rng.random(rows) < 0.02] = None
+    users = np.array(['张三', '李四', '王工', '客服小王'], dtype=object)[rng.integers(0, 4, size=rows)]
+    users[rng.random(rows) < 0.1] = None
+    return pd.DataFrame({
+        'work_order_id': work_ids,
+        'created_at': created_at,
+        'content': content,
+        'oa_user_name': users,
+    })
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比iterrows分组与向量化分组的吞吐量（行/秒）")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument('--legacy-max-rows', type=int, default=5_000_000,
+                        help="超过该行数时跳过iterrows基线（基线在大数据量下非常慢）")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'legacy rows/s':>15} {'vectorized rows/s':>18} {'speedup':>8}")
+    for rows in args.sizes:
+        df = make_frame(rows)
+        grouped, new_time = timed(group_messages, df)
+        if rows <= args.legacy_max_rows:
+            expected, old_time = timed(legacy_group_by_work_order, df)
+            assert list(expected.keys()) == list(grouped.keys()), "工单顺序不一致"
+            assert all(expected[k] == grouped[k] for k in expected), "工单消息不一致"
+            legacy = f"{rows / old_time:>15,.0f}"
+            speedup = f"{old_time / new_time:>7.1f}x"
+        else:
+            legacy, speedup = f"{'skipped':>15}", f"{'-':>8}"
+        print(f"{rows:>10,} {legacy} {rows / new_time:>18,.0f} {speedup}")
+
+
+if __name__ == '__main__':
+    main()
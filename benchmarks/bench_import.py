@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 冷启动时不应加载的重依赖：只在读取工单表、调用模型、导出、去重和检索时才需要
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'aiohttp', 'requests', 'pyarrow', 'tqdm']
+
+
+# 在新的解释器中用 -X importtime 导入模块，返回 (进程总耗时秒, [(模块名, 缩进层级, 自身微秒, 累计微秒)])
+def measure(module):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT_DIR,
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        records.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return elapsed, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量入口模块的导入耗时（python -X importtime），报告最慢的依赖和是否加载了重依赖")
+    parser.add_argument('--module', default='api.index', help="要测量的入口模块（默认Vercel入口api.index）")
+    parser.add_argument('--runs', type=int, default=5, help="测量次数，取中位数（另有一次不计入的预热，用于生成字节码缓存）")
+    parser.add_argument('--top', type=int, default=15, help="列出自身导入耗时最多的前几个顶层包")
+    parser.add_argument('--json', help="将报告以JSON写入该文件，便于与之前的结果比较")
+    parser.add_argument('--budget-ms', type=float, help="入口模块导入耗时的中位数超过该值时退出码为1")
+    args = parser.parse_args()
+
+    measure(args.module)
+    runs = [measure(args.module) for _ in range(args.runs)]
+    import_ms = [next(cumulative for name, depth, _, cumulative in records if name == args.module and depth == 0) / 1000
+                 for _, records in runs]
+    process_ms = [elapsed * 1000 for elapsed, _ in runs]
+
+    # 按顶层包汇总各次测量中自身耗时的中位数
+    package_ms = {}
+    for _, records in runs:
+        totals = {}
+        for name, _, self_us, _ in records:
+            package = name.split('.')[0]
+            totals[package] = totals.get(package, 0) + self_us / 1000
+        for package, total in totals.items():
+            package_ms.setdefault(package, []).append(total)
+    packages = sorted(((statistics.median(values), package) for package, values in package_ms.items()), reverse=True)
+    loaded = sorted({name.split('.')[0] for name, _, _, _ in runs[0][1]} & set(HEAVY_MODULES))
+
+    report = {
+        'module': args.module,
+        'runs': args.runs,
+        'import_ms': round(statistics.median(import_ms), 1),
+        'import_ms_min': round(min(import_ms), 1),
+        'process_ms': round(statistics.median(process_ms), 1),
+        'heavy_modules_loaded': loaded,
+        'packages': {package: round(ms, 1) for ms, package in packages[:args.top]},
+    }
+
+    print(f"导入 {args.module}：中位数 {report['import_ms']} ms（最小 {report['import_ms_min']} ms），"
+          f"解释器启动加导入 {report['process_ms']} ms")
+    print(f"加载的重依赖：{', '.join(loaded) if loaded else '无'}")
+    print(f"{'package':>24} {'self ms':>8}")
+    for package, ms in report['packages'].items():
+        print(f"{package:>24} {ms:>8.1f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.budget_ms and report['import_ms'] > args.budget_ms:
+        print(f"超出预算 {args.budget_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from ingest import work_order_costs
+from llm_client import AsyncDashScopeClient
+from mock_dashscope import start_mock_server
+
+
+# 生成长度偏斜的工单：大部分工单只有几条消息，少数大工单的消息数多出几十倍，且排在最后
+def make_work_orders(count, large_count, large_messages, seed=0):
+    rng = random.Random(seed)
+    work_orders = {}
+    for index in range(count):
+        messages = large_messages if index >= count - large_count else rng.randint(4, 12)
+        work_orders[100000 + index] = [
+            {'user': '客户' if turn % 2 == 0 else '客服小王', 'content': f"第{turn}条：设备开机后屏幕无显示，已检查电源和线缆"}
+            for turn in range(messages)
+        ]
+    return work_orders
+
+
+# 在本地模拟服务上以流水线方式处理同一批工单，返回耗时
+async def run_once(work_orders, latency, per_1k, concurrency):
+    runner, base_url, stats = await start_mock_server(latency=latency, jitter=0, latency_per_1k_tokens=per_1k)
+    try:
+        app.task_store.create('bench-lpt')
+        async with AsyncDashScopeClient('bench', concurrency=concurrency, base_url=base_url, cache=False) as client:
+            start = time.perf_counter()
+            await app.run_pipeline(client, work_orders, 'bench-lpt', single_pass=True)
+            return time.perf_counter() - start, stats['requests']
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比按原顺序与按估算成本从大到小（LPT）调度工单时的总耗时")
+    parser.add_argument('--work-orders', type=int, default=300)
+    parser.add_argument('--large', type=int, default=3, help="大工单数量（排在最后）")
+    parser.add_argument('--large-messages', type=int, default=120, help="大工单的消息数")
+    parser.add_argument('--latency', type=float, default=0.05, help="模拟服务的基础延迟（秒）")
+    parser.add_argument('--latency-per-1k-tokens', type=float, default=0.5, help="每1000个提示词token额外增加的延迟（秒）")
+    parser.add_argument('--concurrency', type=int, default=15)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    work_orders = make_work_orders(args.work_orders, args.large, args.large_messages)
+    costs = work_order_costs(work_orders)
+    print(f"工单 {len(work_orders)} 个，估算token合计 {sum(costs.values()):,}，最大工单 {max(costs.values()):,}")
+    print(f"{'order':>10} {'requests':>9} {'seconds':>8}")
+    default_lookahead = app.WORK_ORDER_LOOKAHEAD
+    for label, lookahead in (('original', 0), ('lpt', default_lookahead)):
+        # 预读窗口为0时按原顺序送入流水线
+        app.WORK_ORDER_LOOKAHEAD = lookahead
+        elapsed, requests = asyncio.run(run_once(work_orders, args.latency, args.latency_per_1k_tokens, args.concurrency))
+        print(f"{label:>10} {requests:>9,} {elapsed:>8.2f}")
+    app.WORK_ORDER_LOOKAHEAD = default_lookahead
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from llm_client import AsyncDashScopeClient
+from mock_dashscope import start_mock_server
+
+
+def make_work_orders(count, messages_per_order=12):
+    lines = ['设备开机后屏幕无显示', '请问设备序列号是多少？', 'SN20250101', '已派工程师上门检查',
+             '检查发现电源模块损坏', '已更换电源模块，设备恢复正常', '好的，谢谢']
+    return {
+        100000 + index: [
+            {'user': '客户' if turn % 2 == 0 else '客服小王', 'content': f"{lines[turn % len(lines)]}（工单{index}）"}
+            for turn in range(messages_per_order)
+        ]
+        for index in range(count)
+    }
+
+
+# 在本地模拟服务上以流水线方式处理同一批工单，返回请求数、token用量和耗时
+async def run_once(work_orders, single_pass, latency, concurrency):
+    runner, base_url, stats = await start_mock_server(latency=latency, jitter=latency / 4)
+    try:
+        task_id = f"bench-{'single' if single_pass else 'two-stage'}"
+        app.task_store.create(task_id)
+        async with AsyncDashScopeClient('bench', concurrency=concurrency, base_url=base_url, cache=False) as client:
+            start = time.perf_counter()
+            cleaned = await app.run_pipeline(client, work_orders, task_id, single_pass=single_pass)
+            elapsed = time.perf_counter() - start
+        return dict(stats, elapsed=elapsed, cleaned=len(cleaned))
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比两阶段（整理+提取）与单次调用模式的请求数、token用量和吞吐量")
+    parser.add_argument('--work-orders', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.3, help="模拟服务的平均响应延迟（秒）")
+    parser.add_argument('--concurrency', type=int, default=15)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    work_orders = make_work_orders(args.work_orders)
+    print(f"{'mode':>10} {'requests':>9} {'prompt tok':>11} {'output tok':>11} {'seconds':>8} {'orders/s':>9} {'kept':>6}")
+    for single_pass in (False, True):
+        result = asyncio.run(run_once(work_orders, single_pass, args.latency, args.concurrency))
+        mode = 'single' if single_pass else 'two-stage'
+        print(f"{mode:>10} {result['requests']:>9,} {result['prompt_tokens']:>11,} {result['completion_tokens']:>11,} "
+              f"{result['elapsed']:>8.2f} {args.work_orders / result['elapsed']:>9.1f} {result['cleaned']:>6}")
+
+
+if __name__ == '__main__':
+    main()
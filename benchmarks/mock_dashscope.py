@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+
+from aiohttp import web
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_client import estimate_tokens
+
+# 本地模拟百炼OpenAI兼容接口（/chat/completions），用于离线测试和压测。
+# 按系统提示词区分各阶段并返回对应格式的回复：
+#   对话整理 -> User/Staff文本；QA提取（含单次调用模式）-> qa_pairs JSON；QA验证 -> yes/no；批量QA验证 -> results JSON
+# 整理和提取的回复根据提示词中的对话内容生成，不同工单得到不同的QA对。
+# GET /stats 返回累计的请求数、token用量，以及按比例注入的错误（500）和限流（429）次数。
+
+_BATCH_ITEM_RE = re.compile(r'^\[(\d+)\] 问题', re.MULTILINE)
+
+# 预设的服务特征：延迟（秒）、每1000个提示词token的额外延迟、注入错误和限流的比例
+PROFILES = {
+    'fast': {'latency': 0.05, 'jitter': 0.01},
+    'realistic': {'latency': 1.0, 'jitter': 0.4, 'latency_per_1k_tokens': 0.3},
+    'flaky': {'latency': 0.3, 'jitter': 0.1, 'error_rate': 0.05},
+    'throttled': {'latency': 0.3, 'jitter': 0.1, 'throttle_rate': 0.1},
+}
+
+
+_LINE_RE = re.compile(r'^[^:\n]{1,40}: (.+)$', re.MULTILINE)
+
+
+# 提示词中对话部分（“对话内容：”或“工单文本：”之后到下一个空行）每行冒号后的内容
+def _conversation_lines(user_prompt):
+    for marker in ('对话内容：', '工单文本：'):
+        if marker in user_prompt:
+            body = user_prompt.split(marker, 1)[1].lstrip('\n').split('\n\n', 1)[0]
+            return [line.strip() for line in _LINE_RE.findall(body)]
+    return []
+
+
+def _reply_for(system_prompt, user_prompt, accept_rate):
+    if '批量QA验证' in system_prompt:
+        indices = [int(index) for index in _BATCH_ITEM_RE.findall(user_prompt)]
+        return json.dumps({'results': [
+            {'index': index, 'verdict': 'yes' if random.random() < accept_rate else 'no'} for index in indices
+        ]})
+    if 'QA验证' in system_prompt:
+        return 'yes' if random.random() < accept_rate else 'no'
+    lines = _conversation_lines(user_prompt)
+    if '问答提取' in system_prompt:
+        if len(lines) < 2:
+            return json.dumps({'qa_pairs': [
+                {'question': '设备无法开机怎么办？', 'answer': '检查电源模块，必要时更换。'},
+                {'question': '网络连接中断如何处理？', 'answer': '重启路由器并检查网线连接。'},
+            ]}, ensure_ascii=False)
+        # 每两行（提问、回答）组成一个QA对，最多两个
+        return json.dumps({'qa_pairs': [
+            {'question': lines[index], 'answer': lines[index + 1]} for index in range(0, min(len(lines) - 1, 4), 2)
+        ]}, ensure_ascii=False)
+    if not lines:
+        return 'User: 设备无法开机\nStaff: 已派工程师上门检查，更换电源模块后恢复正常'
+    return '\n'.join(f"{'User' if index % 2 == 0 else 'Staff'}: {line}" for index, line in enumerate(lines))
+
+
+def _completion(model, content, prompt_tokens):
+    completion_tokens = estimate_tokens(content)
+    return {
+        'id': f"chatcmpl-{uuid.uuid4().hex}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop',
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        },
+        # qwen3系列在本项目中按output.text解析
+        'output': {'text': content},
+    }
+
+
+# latency_per_1k_tokens为每1000个提示词token额外增加的延迟（秒），模拟长对话处理更慢；
+# error_rate、throttle_rate为随机返回500和429（带Retry-After）的请求比例
+def create_app(latency=0.2, jitter=0.1, accept_rate=0.8, latency_per_1k_tokens=0.0, error_rate=0.0, throttle_rate=0.0):
+    stats = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'errors': 0, 'throttled': 0}
+
+    async def chat_completions(request):
+        payload = await request.json()
+        messages = payload.get('messages') or payload.get('input', {}).get('messages', [])
+        system_prompt = next((m['content'] for m in messages if m['role'] == 'system'), '')
+        user_prompt = next((m['content'] for m in messages if m['role'] == 'user'), '')
+        prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+        roll = random.random()
+        if roll < throttle_rate:
+            stats['throttled'] += 1
+            return web.json_response({'error': {'message': 'Requests rate limit exceeded'}}, status=429,
+                                     headers={'Retry-After': '1'})
+        await asyncio.sleep(max(0.0, random.gauss(latency, jitter)) + latency_per_1k_tokens * prompt_tokens / 1000)
+        if roll < throttle_rate + error_rate:
+            stats['errors'] += 1
+            return web.json_response({'error': {'message': 'Internal server error'}}, status=500)
+        content = _reply_for(system_prompt, user_prompt, accept_rate)
+        result = _completion(payload.get('model', ''), content, prompt_tokens)
+        stats['requests'] += 1
+        stats['prompt_tokens'] += result['usage']['prompt_tokens']
+        stats['completion_tokens'] += result['usage']['completion_tokens']
+        return web.json_response(result)
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app['stats'] = stats
+    app.router.add_post('/chat/completions', chat_completions)
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+# 在当前事件循环中启动模拟服务，返回 (runner, base_url, stats)；用完后调用 await runner.cleanup()
+async def start_mock_server(host='127.0.0.1', port=0, **options):
+    mock = create_app(**options)
+    runner = web.AppRunner(mock)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}", mock['stats']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟百炼 /chat/completions 接口")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.2, help="平均响应延迟（秒）")
+    parser.add_argument('--jitter', type=float, default=0.1, help="响应延迟的标准差（秒）")
+    parser.add_argument('--accept-rate', type=float, default=0.8, help="QA验证返回yes的比例")
+    parser.add_argument('--latency-per-1k-tokens', type=float, default=0.0, help="每1000个提示词token额外增加的延迟（秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回500的请求比例")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="返回429的请求比例")
+    parser.add_argument('--profile', choices=sorted(PROFILES), help="使用预设的服务特征，覆盖上面的延迟和错误参数")
+    args = parser.parse_args()
+    options = {
+        'latency': args.latency, 'jitter': args.jitter, 'accept_rate': args.accept_rate,
+        'latency_per_1k_tokens': args.latency_per_1k_tokens, 'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate,
+    }
+    if args.profile:
+        options.update(PROFILES[args.profile])
+    print(f"设置 DASHSCOPE_BASE_URL=http://{args.host}:{args.port} 即可让应用使用该模拟服务")
+    web.run_app(create_app(**options), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
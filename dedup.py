@@ -0,0 +1,109 @@
+import os
+import re
+import hashlib
+import numpy as np
+
+# 近似重复判定阈值（问题字符n-gram集合的Jaccard相似度），设为0时不去重
+QA_DEDUP_THRESHOLD = float(os.getenv('QA_DEDUP_THRESHOLD', '0.8'))
+
+# MinHash签名长度，越长相似度估计越准，计算量也越大
+QA_DEDUP_NUM_PERM = int(os.getenv('QA_DEDUP_NUM_PERM', '64'))
+
+# 字符n-gram长度：中文没有空格分词，按连续字符切分
+QA_DEDUP_NGRAM = 3
+
+_NON_WORD_RE = re.compile(r'[\W_]+')
+
+def _shingles(text, n=QA_DEDUP_NGRAM):
+    # 忽略大小写、空白和标点，只比较文字内容
+    text = _NON_WORD_RE.sub('', str(text or '').lower())
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+# 选择LSH的分段数和每段行数，使候选概率曲线的拐点 (1/b)^(1/r) 最接近阈值
+def _lsh_params(threshold, num_perm):
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+# QA对近似去重：对问题的字符n-gram计算MinHash签名，用LSH分段分桶找候选，
+# 签名估计的Jaccard相似度达到阈值即视为重复。每个QA对只与同桶的代表比较，总耗时随数量近似线性增长。
+# 每个重复簇保留最先加入的QA对作为代表，其余成员的工单ID记录在代表的 duplicate_work_order_ids 中
+class QADeduplicator:
+    def __init__(self, threshold=None, num_perm=None):
+        self.threshold = QA_DEDUP_THRESHOLD if threshold is None else threshold
+        self.num_perm = num_perm or QA_DEDUP_NUM_PERM
+        self.bands, self.rows = _lsh_params(self.threshold, self.num_perm)
+        self.duplicates = 0
+        # 每个哈希函数的种子，与n-gram的哈希值异或后再做splitmix64混合
+        self._seeds = np.random.default_rng(0x5EED).integers(0, 2 ** 63, self.num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        self._representatives = []
+        self._members = []
+
+    # n-gram的哈希用blake2b而不是内置hash()：内置hash()对字符串加了随机盐，不同进程（PYTHONHASHSEED）的去重结果会不同
+    def _signature(self, question):
+        digests = b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest()
+                           for shingle in _shingles(question))
+        hashes = np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+        with np.errstate(over='ignore'):
+            z = (hashes[:, None] ^ self._seeds[None, :]) + np.uint64(0x9E3779B97F4A7C15)
+            z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            z = z ^ (z >> np.uint64(31))
+        return z.min(axis=0)
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def _find(self, signature, keys):
+        checked = set()
+        for band, key in enumerate(keys):
+            for index in self._buckets[band].get(key, ()):
+                if index in checked:
+                    continue
+                checked.add(index)
+                if np.mean(self._signatures[index] == signature) >= self.threshold:
+                    return index
+        return None
+
+    def _insert(self, qa, signature, keys):
+        index = len(self._representatives)
+        self._representatives.append(qa)
+        self._signatures.append(signature)
+        self._members.append({qa.get('work_order_id')})
+        for band, key in enumerate(keys):
+            self._buckets[band].setdefault(key, []).append(index)
+
+    # 加入一个QA对：与已有代表重复时把工单ID记到代表上并返回代表，否则成为新的代表并返回None
+    def add(self, qa):
+        signature = self._signature(qa.get('question'))
+        keys = self._band_keys(signature)
+        index = self._find(signature, keys)
+        if index is None:
+            self._insert(qa, signature, keys)
+            return None
+        representative = self._representatives[index]
+        work_id = qa.get('work_order_id')
+        if work_id not in self._members[index]:
+            self._members[index].add(work_id)
+            representative.setdefault('duplicate_work_order_ids', []).append(work_id)
+        self.duplicates += 1
+        return representative
+
+    # 拆分一组QA对，返回 (需要清洗的代表, 被合并的重复项)
+    def split(self, qa_pairs):
+        unique, duplicates = [], []
+        for qa in qa_pairs:
+            (unique if self.add(qa) is None else duplicates).append(qa)
+        return unique, duplicates
@@ -0,0 +1,157 @@
+import os
+import csv
+import json
+import tempfile
+import threading
+import importlib.util
+from llm_client import estimate_tokens
+from task_store import ExpiredEntrySweeper
+
+# pyarrow为可选依赖，未安装时不提供Parquet导出。只检查是否安装，导出Parquet时才导入（导入较慢）
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+# 导出文件缓存目录：同一结果集的同一格式只生成一次，重复下载直接读取缓存文件
+EXPORT_CACHE_DIR = os.getenv('EXPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'qa_extraction_exports'))
+
+# Parquet每个行组包含的行数，按行组分块写入，内存占用与结果总数无关
+PARQUET_CHUNK_ROWS = int(os.getenv('PARQUET_CHUNK_ROWS', '50000'))
+
+EXPORT_COLUMNS = ['work_order_id', 'question', 'answer']
+
+# 面向检索索引的导出字段（JSONL/Parquet）：QA内容、来源对话哈希、提取模型、各阶段耗时（秒）、估算token数，
+# 以及合并到该QA对上的近似重复QA对所在的工单ID
+RAG_COLUMNS = EXPORT_COLUMNS + [
+    'source_hash', 'model', 'format_seconds', 'extract_seconds', 'clean_seconds', 'tokens', 'duplicate_work_order_ids'
+]
+
+# 支持的导出格式及对应的MIME类型
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+if HAS_PYARROW:
+    EXPORT_FORMATS['parquet'] = 'application/vnd.apache.parquet'
+
+
+# Excel不允许的控制字符会导致写入失败，直接去掉
+def _xlsx_value(value, illegal_re):
+    if isinstance(value, str):
+        return illegal_re.sub('', value)
+    return value
+
+
+# openpyxl只写模式：逐行写入，不在内存中保留整个工作表
+def write_xlsx(rows, path, columns=EXPORT_COLUMNS):
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(columns)
+    for row in rows:
+        sheet.append([_xlsx_value(row.get(column), ILLEGAL_CHARACTERS_RE) for column in columns])
+    workbook.save(path)
+
+
+# 带BOM的UTF-8，Excel打开时中文不会乱码
+def write_csv(rows, path, columns=EXPORT_COLUMNS):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([row.get(column) for column in columns])
+
+
+# 补全检索索引需要的字段：工单ID统一为字符串，缺失的元数据为None，token数按问题和答案估算
+def rag_record(row):
+    record = {column: row.get(column) for column in RAG_COLUMNS}
+    record['work_order_id'] = str(record['work_order_id']) if record['work_order_id'] is not None else None
+    record['duplicate_work_order_ids'] = [str(work_id) for work_id in record['duplicate_work_order_ids'] or []]
+    record['tokens'] = estimate_tokens(str(record['question'] or '')) + estimate_tokens(str(record['answer'] or ''))
+    return record
+
+
+def write_jsonl(rows, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(rag_record(row), ensure_ascii=False))
+            f.write('\n')
+
+
+def _parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('work_order_id', pa.string()),
+        ('question', pa.string()),
+        ('answer', pa.string()),
+        ('source_hash', pa.string()),
+        ('model', pa.string()),
+        ('format_seconds', pa.float64()),
+        ('extract_seconds', pa.float64()),
+        ('clean_seconds', pa.float64()),
+        ('tokens', pa.int64()),
+        ('duplicate_work_order_ids', pa.list_(pa.string())),
+    ])
+
+
+# 按列写入Parquet，每chunk_rows行写一个行组
+def write_parquet(rows, path, chunk_rows=None):
+    if not HAS_PYARROW:
+        raise RuntimeError("导出Parquet需要安装pyarrow")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    chunk_rows = chunk_rows or PARQUET_CHUNK_ROWS
+    schema = _parquet_schema()
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        chunk = []
+        for row in rows:
+            chunk.append(rag_record(row))
+            if len(chunk) >= chunk_rows:
+                writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+                chunk = []
+        if chunk:
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+
+
+_WRITERS = {
+    'xlsx': write_xlsx,
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'parquet': write_parquet,
+}
+
+# 生成任务某个结果集的导出文件并返回路径，结果集不存在时返回None。
+# 文件名包含结果集版本号，结果集更新（如重新筛选）后自动生成新文件，旧版本文件随之删除
+def export_results(store, task_id, name, fmt):
+    version = store.results_version(task_id, name)
+    if version is None:
+        return None
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    prefix = f"{task_id}_{name}_"
+    path = os.path.join(EXPORT_CACHE_DIR, f"{prefix}v{version}.{fmt}")
+    if os.path.exists(path):
+        return path
+    # 先写临时文件再原子替换，并发下载同一结果时不会读到写了一半的文件
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        _WRITERS[fmt](store.iter_results(task_id, name), temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    _remove_files(filename for filename in os.listdir(EXPORT_CACHE_DIR)
+                  if filename.startswith(prefix) and filename.endswith(f".{fmt}") and filename != os.path.basename(path))
+    _sweeper.sweep()
+    return path
+
+
+def _remove_files(names):
+    for name in names:
+        try:
+            os.remove(os.path.join(EXPORT_CACHE_DIR, name))
+        except OSError:
+            pass
+
+
+# 清理超过任务保留时间的导出文件（对应的任务已过期）
+_sweeper = ExpiredEntrySweeper(EXPORT_CACHE_DIR, _remove_files)
@@ -0,0 +1,57 @@
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from ingest import conversation_hash
+from llm_cache import ResponseCache
+
+# 工单指纹库：记录每个工单对话内容的哈希和它最终清洗后的QA对。每天导出的工单表大部分与前一天重复，
+# 内容没有变化的工单直接使用之前的结果，只有新增或内容变化（如追加了消息）的工单才调用模型
+
+# 指纹库文件路径，设为空字符串关闭复用
+FINGERPRINT_STORE_PATH = os.getenv('FINGERPRINT_STORE_PATH',
+                                   os.path.join(tempfile.gettempdir(), 'qa_extraction_fingerprints.sqlite3'))
+# 指纹记录有效期（秒），默认30天，超过后重新处理
+FINGERPRINT_TTL = float(os.getenv('FINGERPRINT_TTL', str(30 * 24 * 3600)))
+
+
+# 指纹：命名空间（租户和模型，不同API密钥之间不共享结果）加上工单对话内容的哈希
+def work_order_fingerprint(namespace, messages):
+    raw = json.dumps([namespace, conversation_hash(messages)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# 指纹库复用模型回复缓存的SQLite存储（按键寻址、过期时间），值为工单清洗后QA对列表的JSON；不按大小淘汰
+class FingerprintStore(ResponseCache):
+    def __init__(self, path, ttl=FINGERPRINT_TTL, evict_every=1000):
+        super().__init__(path, ttl=ttl, max_bytes=0, evict_every=evict_every)
+
+    # 返回之前保存的QA对列表（可能为空列表），没有记录或已过期时返回None
+    def get(self, fingerprint):
+        raw = super().get(fingerprint)
+        return None if raw is None else json.loads(raw)
+
+    def put(self, fingerprint, qa_pairs):
+        super().put(fingerprint, json.dumps(qa_pairs, ensure_ascii=False))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# 进程内共享的指纹库；未配置路径或无法创建文件时返回None（不复用之前的结果）
+def get_fingerprint_store():
+    global _store
+    if not FINGERPRINT_STORE_PATH:
+        return None
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = FingerprintStore(FINGERPRINT_STORE_PATH)
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"无法创建工单指纹库 {FINGERPRINT_STORE_PATH}: {e}")
+                _store = False
+        return _store or None
@@ -0,0 +1,230 @@
+import json
+import hashlib
+import logging
+from contextlib import closing
+from llm_client import estimate_tokens
+
+# pandas、numpy和openpyxl导入较慢，在读取工单表时才导入
+
+# 工单数据需要的列
+WORK_ORDER_COLUMNS = ['work_order_id', 'created_at', 'content', 'oa_user_name']
+
+
+# 向量化按工单ID分组对话内容
+# fill_user为None时丢弃oa_user_name为空的行（AI回复），否则用fill_user填充空的说话者
+def group_messages(df, fill_user=None):
+    df = df[WORK_ORDER_COLUMNS]
+    content = df['content']
+    user = df['oa_user_name']
+
+    # 跳过空内容、缺少工单ID的行
+    mask = content.notna().to_numpy() & df['work_order_id'].notna().to_numpy()
+    mask &= content.astype(str).str.strip().ne('').to_numpy()
+    if fill_user is None:
+        mask &= user.notna().to_numpy()
+    else:
+        df = df.assign(oa_user_name=user.where(user.notna(), fill_user))
+
+    # 稳定排序，保证同一时间的消息保持原有顺序
+    df = df[mask].sort_values(by=['work_order_id', 'created_at'], kind='mergesort')
+    if df.empty:
+        return {}
+
+    ids = df['work_order_id'].tolist()
+    messages = [
+        {'user': u, 'content': c}
+        for u, c in zip(df['oa_user_name'].tolist(), df['content'].tolist())
+    ]
+
+    # 排序后同一工单的行是连续的，用工单ID变化的位置切分
+    import numpy as np
+    import pandas as pd
+    codes, _ = pd.factorize(df['work_order_id'])
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1, [len(codes)])).tolist()
+
+    work_orders = {}
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        work_orders[ids[start]] = messages[start:end]
+    return work_orders
+
+
+# 工单原始对话的哈希，导出时用于追溯QA对的来源，对话内容不变时哈希不变
+def conversation_hash(messages):
+    raw = json.dumps([[str(m['user']), str(m['content'])] for m in messages], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# 单条消息在提示词中的文本
+def message_line(message):
+    return f"{message['user']}: {message['content']}"
+
+
+# 工单对话的估算token数，用于按成本调度工单
+def conversation_tokens(messages):
+    return sum(estimate_tokens(message_line(message)) + 1 for message in messages)
+
+
+# 各工单的估算token数 {工单ID: token数}；WorkOrderStream在预扫描时已统计，不需要再读一遍
+def work_order_costs(work_orders):
+    costs = getattr(work_orders, 'costs', None)
+    if costs is not None:
+        return costs
+    return {work_id: conversation_tokens(messages) for work_id, messages in work_orders.items()}
+
+
+# 按token预算切分一组条目：只在条目之间切分，每个窗口的token数不超过max_tokens（单个条目超出时独占一个窗口）。
+# overlap为相邻窗口重叠的条目数，跨越切分点的提问和回答至少会在一个窗口中同时出现；
+# 重叠不超过窗口条目数的一半（不含），长条目组成的小窗口不会因重叠而几乎每个条目都处理两次
+def _chunk_by_tokens(items, costs, max_tokens, overlap):
+    chunks = []
+    start = 0
+    while start < len(items):
+        end, total = start, 0
+        while end < len(items) and (end == start or total + costs[end] <= max_tokens):
+            total += costs[end]
+            end += 1
+        chunks.append(items[start:end])
+        if end == len(items):
+            break
+        start = end - min(overlap, (end - start - 1) // 2)
+    return chunks
+
+
+# 把超出预算的文本按字符切成多段（每个字符最多计1个token）
+def _split_text(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    return [text[i:i + max_tokens] for i in range(0, len(text), max_tokens)]
+
+
+# 长对话按token预算切分为多个消息窗口，只在消息之间切分；单条消息超出预算时拆成同一说话者的多条消息。
+# 对话不超过预算时返回只包含整段对话的一个窗口
+def chunk_messages(messages, max_tokens, overlap=0):
+    pieces = [
+        {'user': message['user'], 'content': content}
+        for message in messages
+        for content in _split_text(str(message['content']), max_tokens)
+    ]
+    return _chunk_by_tokens(pieces, [estimate_tokens(message_line(m)) + 1 for m in pieces], max_tokens, overlap)
+
+
+# 按token预算把整理后的多行文本切分为多个窗口，只在行之间切分，返回各窗口的文本
+def chunk_text(text, max_tokens, overlap=0):
+    lines = [piece for line in text.splitlines() for piece in _split_text(line, max_tokens)]
+    chunks = _chunk_by_tokens(lines, [estimate_tokens(line) + 1 for line in lines], max_tokens, overlap)
+    return ["\n".join(chunk) for chunk in chunks]
+
+
+# 判断一行是否为有效消息（与group_messages的过滤规则一致）
+def _is_valid_message(work_id, content, user, fill_user):
+    if work_id is None or content is None or str(content).strip() == '':
+        return False
+    return user is not None or fill_user is not None
+
+
+# 组内按created_at排序，空时间排在最后
+def _sort_rows(rows):
+    try:
+        rows.sort(key=lambda r: (r[0] is None, r[0]))
+    except TypeError:
+        # 时间列类型混杂（字符串与日期）时按字符串比较
+        rows.sort(key=lambda r: (r[0] is None, str(r[0])))
+    return rows
+
+
+# 流式读取工单Excel：openpyxl只读模式逐行解析，逐个工单产出消息列表，
+# 只保留work_order_id、created_at、content、oa_user_name四列。
+# 同一工单的行在表中连续时（系统导出的默认顺序），内存峰值只与最大的单个工单有关；
+# 不连续或无法以只读模式打开（如.xls）时回退为整表读取后分组。
+class WorkOrderStream:
+    def __init__(self, file_input, fill_user=None):
+        self.file_input = file_input
+        self.fill_user = fill_user
+        self._grouped = None
+        self._count = 0
+        # 各工单的估算token数，预扫描时统计
+        self.costs = {}
+        from openpyxl.utils.exceptions import InvalidFileException
+        try:
+            contiguous = self._scan()
+        except InvalidFileException:
+            contiguous = False
+        if not contiguous:
+            logging.warning("工单数据不是按工单ID连续排列或不是xlsx格式，回退为整表读取")
+            self._rewind()
+            import pandas as pd
+            df = pd.read_excel(self.file_input, usecols=WORK_ORDER_COLUMNS)
+            self._grouped = group_messages(df, fill_user=fill_user)
+            self._count = len(self._grouped)
+            self.costs = {work_id: conversation_tokens(messages) for work_id, messages in self._grouped.items()}
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return self.items()
+
+    def _rewind(self):
+        if hasattr(self.file_input, 'seek'):
+            self.file_input.seek(0)
+
+    # 逐行产出 (work_order_id, created_at, content, oa_user_name)
+    def _rows(self):
+        from openpyxl import load_workbook
+        self._rewind()
+        wb = load_workbook(self.file_input, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0]
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            index = {name: i for i, name in enumerate(header) if name in WORK_ORDER_COLUMNS}
+            missing = [name for name in WORK_ORDER_COLUMNS if name not in index]
+            if missing:
+                raise KeyError(f"Excel缺少必要的列: {', '.join(missing)}")
+            positions = [index[name] for name in WORK_ORDER_COLUMNS]
+            for row in rows:
+                values = [row[i] if i < len(row) else None for i in positions]
+                yield tuple(values)
+        finally:
+            wb.close()
+
+    # 预扫描：统计有效工单数和各工单的估算token数，并检查同一工单的行是否连续
+    def _scan(self):
+        costs = {}
+        current = None
+        with closing(self._rows()) as rows:
+            for work_id, _, content, user in rows:
+                if not _is_valid_message(work_id, content, user, self.fill_user):
+                    continue
+                if work_id != current:
+                    if work_id in costs:
+                        return False
+                    costs[work_id] = 0
+                    current = work_id
+                message = {'user': user if user is not None else self.fill_user, 'content': content}
+                costs[work_id] += estimate_tokens(message_line(message)) + 1
+        self._count = len(costs)
+        self.costs = costs
+        return True
+
+    def _build_messages(self, rows):
+        return [
+            {'user': user if user is not None else self.fill_user, 'content': content}
+            for _, user, content in _sort_rows(rows)
+        ]
+
+    def items(self):
+        if self._grouped is not None:
+            yield from self._grouped.items()
+            return
+        current, buffer = None, []
+        for work_id, created_at, content, user in self._rows():
+            if not _is_valid_message(work_id, content, user, self.fill_user):
+                continue
+            if work_id != current and buffer:
+                yield current, self._build_messages(buffer)
+                buffer = []
+            current = work_id
+            buffer.append((created_at, user, content))
+        if buffer:
+            yield current, self._build_messages(buffer)
@@ -0,0 +1,131 @@
+import os
+import heapq
+import logging
+import itertools
+import threading
+from collections import OrderedDict, deque
+
+# 同时运行的任务数上限，超出的任务排队等待
+JOB_MAX_RUNNING = int(os.getenv('JOB_MAX_RUNNING', '2'))
+
+# 按成本排序工单时最多预读的工单数（流式读取时只在这个范围内排序，内存占用有上限）
+WORK_ORDER_LOOKAHEAD = int(os.getenv('WORK_ORDER_LOOKAHEAD', '1000'))
+
+
+# 最长处理时间优先（LPT）：按估算成本从大到小产出items，大工单最先开始，不会排在最后拖长整个任务的耗时。
+# lookahead为None时整体排序；否则最多预读lookahead个条目，每次产出其中成本最大的一个。成本相同时保持原有顺序
+def lpt_order(items, cost, lookahead=None):
+    if lookahead is None:
+        yield from sorted(items, key=cost, reverse=True)
+        return
+    heap = []
+    counter = itertools.count()
+    for item in items:
+        heapq.heappush(heap, (-cost(item), next(counter), item))
+        if len(heap) > lookahead:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+# 任务调度器：固定数量的工作线程执行任务，排队的任务按租户（API密钥）分组，
+# 组内先进先出，组间轮流调度，单个租户一次提交大量任务不会让其他租户一直等待。
+# 排队顺序变化时调用on_change({job_id: 排队位置})，位置从1开始
+class JobScheduler:
+    def __init__(self, max_running=None, on_change=None):
+        self.max_running = max(1, max_running or JOB_MAX_RUNNING)
+        self.on_change = on_change
+        self._queues = OrderedDict()
+        self._running = set()
+        self._workers = []
+        self._cond = threading.Condition()
+
+    # 提交任务，返回排队位置；工作线程在第一次提交时才启动
+    def submit(self, job_id, tenant, target, *args, **kwargs):
+        with self._cond:
+            self._start_workers()
+            self._queues.setdefault(tenant, deque()).append((job_id, target, args, kwargs))
+            positions = self._positions()
+            self._cond.notify()
+        self._notify(positions)
+        return positions.get(job_id, 0)
+
+    # 取消排队中的任务，返回是否找到；已开始运行的任务需要由任务自身响应取消
+    def cancel(self, job_id):
+        with self._cond:
+            for tenant, jobs in self._queues.items():
+                job = next((job for job in jobs if job[0] == job_id), None)
+                if job is not None:
+                    break
+            else:
+                return False
+            jobs.remove(job)
+            if not jobs:
+                del self._queues[tenant]
+            positions = self._positions()
+        self._notify(positions)
+        return True
+
+    def is_running(self, job_id):
+        with self._cond:
+            return job_id in self._running
+
+    def running_count(self):
+        with self._cond:
+            return len(self._running)
+
+    def positions(self):
+        with self._cond:
+            return self._positions()
+
+    # 按实际调度顺序（各租户轮流取一个）计算每个排队任务的位置
+    def _positions(self):
+        positions = {}
+        queues = [list(jobs) for jobs in self._queues.values()]
+        total = sum(len(jobs) for jobs in queues)
+        depth = 0
+        while len(positions) < total:
+            for jobs in queues:
+                if depth < len(jobs):
+                    positions[jobs[depth][0]] = len(positions) + 1
+            depth += 1
+        return positions
+
+    # 取出下一个任务：排在最前面的租户出队一个任务，然后该租户移到队尾
+    def _next_job(self):
+        tenant, jobs = next(iter(self._queues.items()))
+        job = jobs.popleft()
+        del self._queues[tenant]
+        if jobs:
+            self._queues[tenant] = jobs
+        return job
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_running:
+            worker = threading.Thread(target=self._work, name=f"job-worker-{len(self._workers)}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queues:
+                    self._cond.wait()
+                job_id, target, args, kwargs = self._next_job()
+                self._running.add(job_id)
+                positions = self._positions()
+            self._notify(positions)
+            try:
+                target(*args, **kwargs)
+            except Exception as e:
+                logging.error(f"任务 {job_id} 执行出错: {e}")
+            finally:
+                with self._cond:
+                    self._running.discard(job_id)
+
+    def _notify(self, positions):
+        if self.on_change:
+            try:
+                self.on_change(positions)
+            except Exception as e:
+                logging.error(f"更新排队位置时出错: {e}")
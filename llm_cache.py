@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+
+# 模型回复缓存文件路径，设为空字符串关闭缓存
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'qa_extraction_llm_cache.sqlite3'))
+# 缓存有效期（秒），默认7天
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600)))
+# 缓存总大小上限（MB），超出后按最近最少使用淘汰
+LLM_CACHE_MAX_MB = float(os.getenv('LLM_CACHE_MAX_MB', '512'))
+
+
+# 缓存键：模型、系统提示词、用户提示词和enable_thinking的哈希
+def cache_key(model, system_prompt, user_prompt, enable_thinking=False):
+    raw = json.dumps([model, system_prompt, user_prompt, bool(enable_thinking)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# 基于SQLite的模型回复缓存，按内容寻址，支持过期时间和按大小的LRU淘汰。
+# 同一进程内所有线程共用一个连接，读写由锁串行化。
+class ResponseCache:
+    def __init__(self, path, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024, evict_every=200):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self._puts = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return response
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode('utf-8')), now, now)
+            )
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict(now)
+
+    # 删除过期记录，总大小超出上限时从最久未访问的记录开始删除
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        if not self.max_bytes:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        cutoff = None
+        freed = 0
+        for size, accessed_at in self._conn.execute("SELECT size, accessed_at FROM responses ORDER BY accessed_at"):
+            freed += size
+            cutoff = accessed_at
+            if freed >= excess:
+                break
+        if cutoff is not None:
+            self._conn.execute("DELETE FROM responses WHERE accessed_at <= ?", (cutoff,))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# 进程内共享的回复缓存；未配置路径或无法创建缓存文件时返回None（不使用缓存）
+def get_response_cache():
+    global _cache
+    if not LLM_CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ResponseCache(LLM_CACHE_PATH)
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"无法创建模型回复缓存 {LLM_CACHE_PATH}: {e}")
+                _cache = False
+        return _cache or None
@@ -0,0 +1,271 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from rate_limiter import get_rate_limiter, parse_retry_after, backoff_delay
+from llm_cache import get_response_cache, cache_key
+from metrics import LLM_REQUESTS, LLM_REQUEST_SECONDS, LLM_RETRIES, LLM_TIMEOUTS, LLM_TOKENS
+
+# 百炼OpenAI兼容接口地址，可通过环境变量指向本地模拟服务
+DASHSCOPE_BASE_URL = os.getenv('DASHSCOPE_BASE_URL', 'https://dashscope.aliyuncs.com/compatible-mode/v1')
+# 单个进程内同时进行中的API请求数上限
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', '15'))
+# 429重试次数上限（不计入普通错误的重试次数）
+LLM_MAX_THROTTLE_RETRIES = int(os.getenv('LLM_MAX_THROTTLE_RETRIES', '8'))
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
+def chat_completions_url(base_url=None):
+    return f"{(base_url or DASHSCOPE_BASE_URL).rstrip('/')}/chat/completions"
+
+
+# 粗略估算文本的token数：中文字符约1个token，其余字符约4个字符1个token
+def estimate_tokens(text):
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+# 除408和429外的4xx错误（密钥无效、请求格式错误等）重试也不会成功
+def is_retryable_status(status):
+    return status >= 500 or status in (408, 429)
+
+
+# 响应中的实际token用量，没有usage字段时返回None
+def usage_tokens(result):
+    usage = result.get('usage') if isinstance(result, dict) else None
+    if usage and 'total_tokens' in usage:
+        return usage['total_tokens']
+    return None
+
+
+# 记录一次成功响应的token用量，返回 (提示词token数, 回复token数)；接口没有返回用量时按估算值记录
+def record_usage(model, result, prompt_estimate, text):
+    usage = (result.get('usage') if isinstance(result, dict) else None) or {}
+    tokens_in = usage.get('prompt_tokens', prompt_estimate)
+    tokens_out = usage.get('completion_tokens', estimate_tokens(text))
+    LLM_TOKENS.inc(tokens_in, model=model, direction='in')
+    LLM_TOKENS.inc(tokens_out, model=model, direction='out')
+    return tokens_in, tokens_out
+
+
+# 构建请求体
+def build_payload(model, system_prompt, user_prompt, enable_thinking=False):
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    extra_body = {"enable_thinking": enable_thinking} if enable_thinking else {}
+    if model.startswith('qwen3'):
+        return {"model": model, "input": {"messages": messages}, "extra_body": extra_body}
+    return {"model": model, "messages": messages, "extra_body": extra_body}
+
+
+# 从响应中取出模型回复文本，没有可用内容时返回None
+def parse_response(model, result):
+    if model.startswith('qwen3'):
+        if 'output' in result and 'text' in result['output']:
+            return result['output']['text'].strip()
+    else:
+        if 'choices' in result and len(result['choices']) > 0 and 'message' in result['choices'][0]:
+            return result['choices'][0]['message']['content'].strip()
+    return None
+
+
+# 进程内所有任务共用的并发请求上限。每个任务在自己的线程和事件循环中运行，asyncio.Semaphore不能跨事件循环使用，
+# 这里用线程锁计数，释放时把空位直接交给最早等待的请求（通过其事件循环唤醒）。
+# 只有一个任务运行时它可以用满全部并发，多个任务同时运行时按请求先后共享，不会有空闲的配额
+class RequestSlots:
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self._active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # 空位已经交给了这个请求：已唤醒的由这里归还，还没唤醒的由_grant归还
+            if waiter[1].done() and not waiter[1].cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._grant, future)
+                    return
+                except RuntimeError:
+                    continue  # 等待者的事件循环已关闭
+            self._active -= 1
+
+    def _grant(self, future):
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+_request_slots = RequestSlots(LLM_CONCURRENCY)
+
+
+# 进程内共享的并发请求上限（LLM_CONCURRENCY）
+def get_request_slots():
+    return _request_slots
+
+
+# 异步百炼API客户端：所有请求共享一个保持长连接的连接池，
+# 通过信号量限制同时进行中的请求数（slots为RequestSlots时与其他客户端共用上限），并通过同一API密钥共享的限流器控制请求速率。
+# 相同请求优先从回复缓存读取，cache_stats按阶段记录缓存命中/未命中次数；
+# call_stats按阶段记录实际API调用的次数、失败、重试、超时、token用量和累计耗时（秒）
+class AsyncDashScopeClient:
+    def __init__(self, api_key, concurrency=None, base_url=None, timeout=90, max_retries=3, limiter=None, cache=None,
+                 slots=None):
+        self.api_key = api_key
+        self.concurrency = concurrency or LLM_CONCURRENCY
+        self.url = chat_completions_url(base_url)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = limiter or get_rate_limiter(api_key)
+        self.cache = cache if cache is not None else get_response_cache()
+        self.cache_stats = {}
+        self.call_stats = {}
+        self.slots = slots
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        # aiohttp只在真正发起请求时导入，不影响只查询任务状态的冷启动
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            }
+        )
+        self._semaphore = self.slots or asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+
+    def _count(self, stage, outcome):
+        stats = self.cache_stats.setdefault(stage, {'hit': 0, 'miss': 0})
+        stats[outcome] += 1
+
+    def _stage_stats(self, stage):
+        return self.call_stats.setdefault(stage, {
+            'calls': 0, 'failed': 0, 'retries': 0, 'timeouts': 0, 'tokens_in': 0, 'tokens_out': 0, 'seconds': 0.0
+        })
+
+    def _retry(self, model, stage, reason):
+        LLM_RETRIES.inc(model=model, reason=reason)
+        self._stage_stats(stage)['retries'] += 1
+
+    # stage用于按阶段统计缓存命中，默认使用模型名
+    async def chat(self, model, system_prompt, user_prompt, enable_thinking=False, stage=None):
+        stage = stage or model
+        key = None
+        if self.cache:
+            key = cache_key(model, system_prompt, user_prompt, enable_thinking)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._count(stage, 'hit')
+                LLM_REQUESTS.inc(model=model, stage=stage, outcome='cache_hit')
+                return cached
+            self._count(stage, 'miss')
+        start = time.perf_counter()
+        text = await self._request(model, system_prompt, user_prompt, enable_thinking, stage)
+        elapsed = time.perf_counter() - start
+        LLM_REQUEST_SECONDS.observe(elapsed, model=model, stage=stage)
+        LLM_REQUESTS.inc(model=model, stage=stage, outcome='failed' if text is None else 'ok')
+        stats = self._stage_stats(stage)
+        stats['calls'] += 1
+        stats['seconds'] = round(stats['seconds'] + elapsed, 3)
+        if text is None:
+            stats['failed'] += 1
+        if key and text is not None:
+            self.cache.put(key, text)
+        return text
+
+    async def _request(self, model, system_prompt, user_prompt, enable_thinking, stage):
+        from aiohttp import ClientError
+        payload = build_payload(model, system_prompt, user_prompt, enable_thinking)
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+        errors = throttled = 0
+        while errors < self.max_retries:
+            await self.limiter.acquire(tokens)
+            try:
+                async with self._semaphore:
+                    async with self._session.post(self.url, json=payload) as response:
+                        if response.status == 429:
+                            throttled += 1
+                            self.limiter.on_throttled(parse_retry_after(response.headers.get('Retry-After')))
+                            if throttled > LLM_MAX_THROTTLE_RETRIES:
+                                logging.error(f"API持续限流，已重试 {throttled - 1} 次，放弃请求")
+                                return None
+                            logging.warning(f"API限流(429)，降低请求速率后重试 {throttled}/{LLM_MAX_THROTTLE_RETRIES}")
+                            self._retry(model, stage, 'throttled')
+                            continue
+                        if response.status >= 400 and not is_retryable_status(response.status):
+                            logging.error(f"API调用出错: HTTP {response.status} {await response.text()}")
+                            return None
+                        response.raise_for_status()
+                        result = await response.json(content_type=None)
+                self.limiter.on_success(tokens, usage_tokens(result))
+                text = parse_response(model, result)
+                if text is not None:
+                    tokens_in, tokens_out = record_usage(model, result, tokens, text)
+                    stats = self._stage_stats(stage)
+                    stats['tokens_in'] += tokens_in
+                    stats['tokens_out'] += tokens_out
+                    return text
+                # 响应正常但没有可用内容，立即重试，不需要退避
+                logging.warning(f"API响应中没有可用内容，重试 {errors+1}/{self.max_retries}")
+                errors += 1
+                if errors < self.max_retries:
+                    self._retry(model, stage, 'empty')
+                continue
+            except asyncio.TimeoutError:
+                logging.warning(f"API请求超时，重试 {errors+1}/{self.max_retries}")
+                LLM_TIMEOUTS.inc(model=model)
+                self._stage_stats(stage)['timeouts'] += 1
+                reason = 'timeout'
+            except (ClientError, json.JSONDecodeError) as e:
+                logging.error(f"API调用出错: {e}")
+                reason = 'error'
+            errors += 1
+            if errors < self.max_retries:
+                self._retry(model, stage, reason)
+                await asyncio.sleep(backoff_delay(errors - 1))
+        return None
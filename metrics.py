@@ -0,0 +1,136 @@
+import math
+import threading
+
+# 进程内指标，/metrics 按Prometheus文本格式输出。
+# 多个worker进程时每个进程各自统计，由Prometheus分别抓取后汇总
+
+# LLM请求耗时的分桶（秒），覆盖到默认请求超时90秒
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    # 当前各标签组合的值 {标签值元组: 值}
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, tuple(zip(self.labelnames, key)), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                labels = tuple(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", labels + (('le', _format_value(bound)),), count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+
+# 记录阶段处理完成的条目数和耗时
+def record_stage(stage, seconds, items=1):
+    STAGE_ITEMS.inc(items, stage=stage)
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+# 所有指标的Prometheus文本格式
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+LLM_REQUESTS = Counter('qa_llm_requests_total', 'LLM调用次数（outcome: ok成功, failed重试后仍失败, cache_hit命中回复缓存）',
+                       ['model', 'stage', 'outcome'])
+LLM_REQUEST_SECONDS = Histogram('qa_llm_request_seconds', 'LLM调用耗时（含限流等待和重试，不含缓存命中）',
+                                ['model', 'stage'])
+LLM_RETRIES = Counter('qa_llm_retries_total', 'LLM调用重试次数（reason: timeout, throttled, error, empty）',
+                      ['model', 'reason'])
+LLM_TIMEOUTS = Counter('qa_llm_timeouts_total', 'LLM请求超时次数', ['model'])
+LLM_TOKENS = Counter('qa_llm_tokens_total', 'LLM token用量（direction: in提示词, out回复；接口未返回用量时为估算值）',
+                     ['model', 'direction'])
+STAGE_ITEMS = Counter('qa_stage_items_total', '各阶段处理完成的条目数（format/extract为工单，clean为QA对）', ['stage'])
+STAGE_SECONDS = Histogram('qa_stage_seconds', '各阶段处理单个条目（clean为一批QA对）的耗时', ['stage'])
+QUEUE_DEPTH = Gauge('qa_pipeline_queue_depth', '流水线各阶段输入队列中等待处理的条目数', ['stage'])
+JOBS = Gauge('qa_jobs', '当前进程中排队和运行中的任务数（state: queued, running）', ['state'])
+TASKS = Counter('qa_tasks_total', '结束的任务数（outcome: completed, failed, cancelled）', ['outcome'])
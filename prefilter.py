@@ -0,0 +1,70 @@
+import os
+import re
+from collections import Counter
+
+# 工单预筛选：调用API之前在本地检查每个工单，跳过明显没有有效内容的工单（只有寒暄、系统消息等）。
+# 每条规则设为0或空即关闭，默认全部关闭（简短的工单也可能包含有用的问答），需要时由部署配置开启
+
+# 消息数少于该值的工单跳过（默认1，即不按消息数筛选；只有一条消息的工单也可能包含完整的问题描述，需要时再开启）
+PREFILTER_MIN_MESSAGES = int(os.getenv('PREFILTER_MIN_MESSAGES', '1'))
+# 不同说话者少于该值的工单跳过（默认1，即不按说话者数筛选）
+PREFILTER_MIN_SPEAKERS = int(os.getenv('PREFILTER_MIN_SPEAKERS', '1'))
+# 去掉寒暄消息后，有效内容的总字符数少于该值的工单跳过（默认0，即不按长度筛选）
+PREFILTER_MIN_CHARS = int(os.getenv('PREFILTER_MIN_CHARS', '0'))
+# 寒暄消息（整条消息由这些词组成时不计入有效内容，全部是寒暄的工单跳过），默认不启用。例如：
+#   ((好的?|好嘞|嗯|哦|收到|谢谢|多谢|感谢|不客气|没问题|在吗|您好|你好|ok|okay|thanks?)[\s\W]*)+
+PREFILTER_TRIVIAL_PATTERN = os.getenv('PREFILTER_TRIVIAL_PATTERN', '')
+# 任一消息包含该模式时跳过整个工单（如测试工单、系统自动通知），默认不启用
+PREFILTER_EXCLUDE_PATTERN = os.getenv('PREFILTER_EXCLUDE_PATTERN', '')
+
+# 跳过原因
+SKIP_EXCLUDED = 'excluded'
+SKIP_TOO_FEW_MESSAGES = 'too_few_messages'
+SKIP_TOO_FEW_SPEAKERS = 'too_few_speakers'
+SKIP_TRIVIAL_ONLY = 'trivial_only'
+SKIP_TOO_SHORT = 'too_short'
+
+
+# 按规则依次检查工单，返回第一个不满足的规则作为跳过原因，并按原因累计跳过的工单数
+class WorkOrderFilter:
+    def __init__(self, min_messages=None, min_speakers=None, min_chars=None, trivial_pattern=None,
+                 exclude_pattern=None):
+        self.min_messages = PREFILTER_MIN_MESSAGES if min_messages is None else min_messages
+        self.min_speakers = PREFILTER_MIN_SPEAKERS if min_speakers is None else min_speakers
+        self.min_chars = PREFILTER_MIN_CHARS if min_chars is None else min_chars
+        trivial_pattern = PREFILTER_TRIVIAL_PATTERN if trivial_pattern is None else trivial_pattern
+        exclude_pattern = PREFILTER_EXCLUDE_PATTERN if exclude_pattern is None else exclude_pattern
+        self.trivial_re = re.compile(trivial_pattern, re.IGNORECASE) if trivial_pattern else None
+        self.exclude_re = re.compile(exclude_pattern, re.IGNORECASE) if exclude_pattern else None
+        self.skipped = Counter()
+
+    def _is_trivial(self, content):
+        return self.trivial_re is not None and self.trivial_re.fullmatch(content.strip()) is not None
+
+    # 返回跳过原因，值得处理的工单返回None
+    def reason(self, messages):
+        contents = [str(message['content']) for message in messages]
+        if self.exclude_re is not None and any(self.exclude_re.search(content) for content in contents):
+            return SKIP_EXCLUDED
+        if len(messages) < self.min_messages:
+            return SKIP_TOO_FEW_MESSAGES
+        if len({message['user'] for message in messages}) < self.min_speakers:
+            return SKIP_TOO_FEW_SPEAKERS
+        meaningful = [content for content in contents if not self._is_trivial(content)]
+        if not meaningful:
+            return SKIP_TRIVIAL_ONLY
+        if sum(len(content.strip()) for content in meaningful) < self.min_chars:
+            return SKIP_TOO_SHORT
+        return None
+
+    # 检查工单，需要跳过时记录原因并返回True
+    def skip(self, messages):
+        reason = self.reason(messages)
+        if reason is None:
+            return False
+        self.skipped[reason] += 1
+        return True
+
+    @property
+    def skipped_total(self):
+        return sum(self.skipped.values())
@@ -0,0 +1,110 @@
+import os
+import time
+
+# 任务进度统计：各阶段累计完成的条目数，按阶段权重合成单调递增的总进度，
+# 并根据已完成工作量的速度估算剩余时间。进度按时间间隔节流发布，逐条目的开销只有一次计数和一次时钟读取。
+# 计数只在任务自己的事件循环线程中修改，不需要加锁
+
+# 两次发布进度之间的最小间隔（秒）
+PROGRESS_PUBLISH_INTERVAL = float(os.getenv('PROGRESS_PUBLISH_INTERVAL', '1'))
+
+
+class _Stage:
+    def __init__(self, weight, total, scale_by, costs):
+        self.weight = weight
+        self.scale_by = scale_by
+        self.costs = costs
+        self.done = 0
+        self.total = total
+        self.work = 0.0
+        self.cost_done = 0
+        self.cost_total = sum(costs.values()) if costs else 0
+
+
+# publish(tracker, progress, eta_seconds) 在进度变化后最多每interval秒调用一次；
+# 进度从start到end，只增不减（阶段总量增加导致比例下降时保持之前的值）
+class ProgressTracker:
+    def __init__(self, publish, start=0.0, end=100.0, interval=None, clock=time.monotonic):
+        self.publish = publish
+        self.start = start
+        self.end = end
+        self.interval = PROGRESS_PUBLISH_INTERVAL if interval is None else interval
+        self.clock = clock
+        self._stages = {}
+        self._started = clock()
+        self._last_publish = float('-inf')
+        self._published = start
+
+    # 添加阶段。weight为该阶段在总进度中的权重（0为只计数，不计入进度），可以是函数weight(tracker)，
+    # 用于按处理过程中得到的信息（如已产生条目的工作量）估算；total为条目总数，处理过程中可以增加。
+    # scale_by为另一个阶段名时，本阶段的完成比例再乘以该阶段的完成比例：条目由上一阶段产生、总数要到上一阶段结束才确定。
+    # costs为 {条目: 工作量} 时完成比例按已完成条目的工作量计算（大条目先处理时按条目数会低估进度），advance需传入item
+    def add_stage(self, name, weight, total=0, scale_by=None, costs=None):
+        self._stages[name] = _Stage(weight, total, scale_by, costs)
+        return self
+
+    def __contains__(self, name):
+        return name in self._stages
+
+    def advance(self, name, count=1, item=None):
+        stage = self._stages[name]
+        stage.done += count
+        if stage.costs is not None and item is not None:
+            stage.cost_done += stage.costs.get(item, 0)
+        self.maybe_publish()
+
+    # 增加阶段的条目总数；work为这些条目的工作量（如估算的token数），供权重函数使用
+    def add_total(self, name, count, work=0):
+        stage = self._stages[name]
+        stage.total += count
+        stage.work += work
+
+    def done(self, name):
+        return self._stages[name].done
+
+    def total(self, name):
+        return self._stages[name].total
+
+    def work(self, name):
+        return self._stages[name].work
+
+    def weight(self, name):
+        weight = self._stages[name].weight
+        return weight(self) if callable(weight) else weight
+
+    # 阶段的完成比例（0到1），总数为0时视为已完成
+    def fraction(self, name):
+        stage = self._stages[name]
+        if stage.cost_total:
+            own = min(stage.cost_done / stage.cost_total, 1.0)
+        else:
+            own = min(stage.done / stage.total, 1.0) if stage.total else 1.0
+        if stage.scale_by is not None:
+            own *= self.fraction(stage.scale_by)
+        return own
+
+    # 按权重合成的总完成比例（0到1）
+    def overall(self):
+        weights = {name: self.weight(name) for name in self._stages}
+        total = sum(weights.values())
+        if not total:
+            return 0.0
+        return sum(weight * self.fraction(name) for name, weight in weights.items() if weight) / total
+
+    # 按开始以来的完成速度估算的剩余秒数，还没有完成任何工作时返回None
+    def eta(self):
+        fraction = self.overall()
+        if fraction <= 0:
+            return None
+        return (self.clock() - self._started) * (1 - fraction) / fraction
+
+    # 距上次发布超过间隔时发布进度，force为True时不受间隔限制
+    def maybe_publish(self, force=False):
+        now = self.clock()
+        if not force and now - self._last_publish < self.interval:
+            return
+        self._last_publish = now
+        progress = self.start + (self.end - self.start) * self.overall()
+        self._published = max(self._published, progress)
+        eta = self.eta()
+        self.publish(self, round(self._published, 2), None if eta is None else round(eta, 1))
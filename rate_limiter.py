@@ -0,0 +1,154 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+# 每秒请求数和每分钟token数的上限（服务商配额），0表示不限制
+LLM_MAX_RPS = float(os.getenv('LLM_MAX_RPS', '20'))
+LLM_MAX_TPM = float(os.getenv('LLM_MAX_TPM', '1000000'))
+
+
+# 令牌桶：暂停期间不补充令牌
+class _TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    # 取出amount个令牌还需等待的秒数，0表示现在就可以取
+    def wait_time(self, amount, now):
+        self._refill(now)
+        if now < self.updated:
+            return self.updated - now
+        # 超过桶容量的请求在桶满时放行，否则永远等不到
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= amount
+
+    def pause(self, until):
+        self._refill(time.monotonic())
+        self.updated = max(self.updated, until)
+
+
+# 自适应限流器：同一API密钥的所有请求共享请求数和token数两个令牌桶。
+# 出现429时请求速率减半（加性增、乘性减），并按Retry-After暂停所有请求；
+# 不再出现429后速率按时间线性恢复（默认约20秒从0恢复到配额上限）。
+# 等待中的请求每隔一小段时间重新检查，速率调整会立即对它们生效。线程安全，不同线程中的事件循环可共享同一实例。
+class AdaptiveRateLimiter:
+    def __init__(self, max_rps=None, max_tpm=None, min_rps=0.5, decrease_factor=0.5, recovery_seconds=20):
+        self.max_rps = max_rps if max_rps is not None else LLM_MAX_RPS
+        self.max_tpm = max_tpm if max_tpm is not None else LLM_MAX_TPM
+        self.min_rps = min(min_rps, self.max_rps) if self.max_rps else min_rps
+        self.decrease_factor = decrease_factor
+        self.recovery_rate = self.max_rps / recovery_seconds if self.max_rps else 0
+        self.rps = self.max_rps
+        self.throttled_count = 0
+        self._lock = threading.Lock()
+        self._requests = _TokenBucket(self.max_rps, max(1.0, self.max_rps)) if self.max_rps else None
+        self._tokens = _TokenBucket(self.max_tpm / 60, self.max_tpm) if self.max_tpm else None
+        self._paused_until = 0.0
+        self._last_adjust = 0.0
+        self._last_decrease = 0.0
+
+    # 两个桶都有余量时同时取出并返回0，否则不取令牌，返回建议的等待秒数
+    def _try_acquire(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._paused_until - now
+            if self._requests:
+                delay = max(delay, self._requests.wait_time(1, now))
+            if self._tokens and tokens:
+                delay = max(delay, self._tokens.wait_time(tokens, now))
+            if delay > 0:
+                return delay
+            if self._requests:
+                self._requests.take(1)
+            if self._tokens and tokens:
+                self._tokens.take(tokens)
+            return 0.0
+
+    # 单次等待不超过1秒，加少量随机抖动，避免等待者同时醒来
+    @staticmethod
+    def _sleep_time(delay):
+        return min(delay, 1.0) * random.uniform(1.0, 1.2)
+
+    async def acquire(self, tokens=0):
+        while True:
+            delay = self._try_acquire(tokens)
+            if delay <= 0:
+                return
+            await asyncio.sleep(self._sleep_time(delay))
+
+    # 请求成功：按实际用量修正token桶，并逐步提高请求速率
+    def on_success(self, estimated_tokens=0, actual_tokens=None):
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens and actual_tokens is not None:
+                self._tokens.take(actual_tokens - estimated_tokens)
+            if self._requests and self.rps < self.max_rps and now > self._paused_until:
+                elapsed = now - max(self._last_adjust, self._paused_until)
+                self._set_rps(min(self.max_rps, self.rps + self.recovery_rate * elapsed))
+                self._last_adjust = now
+
+    # 收到429：降低请求速率并暂停所有请求，同一时刻的一批429只降速一次
+    def on_throttled(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self.throttled_count += 1
+            if self._requests and now - self._last_decrease >= 1.0:
+                self._set_rps(max(self.min_rps, self.rps * self.decrease_factor))
+                self._last_decrease = now
+            self._last_adjust = now
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+                for bucket in (self._requests, self._tokens):
+                    if bucket:
+                        bucket.pause(self._paused_until)
+
+    def _set_rps(self, rps):
+        self.rps = rps
+        self._requests.rate = rps
+        self._requests.capacity = max(1.0, rps)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+# 获取某个API密钥共享的限流器（同一进程内所有任务、所有阶段共用）
+def get_rate_limiter(api_key):
+    with _limiters_lock:
+        if api_key not in _limiters:
+            _limiters[api_key] = AdaptiveRateLimiter()
+        return _limiters[api_key]
+
+
+# 解析Retry-After响应头（秒数或HTTP日期），无法解析时返回None
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# 网络错误、超时和5xx的重试等待：带随机抖动的指数退避，避免所有请求同时重试
+def backoff_delay(retry, base=1.0, cap=30.0):
+    return random.uniform(0, min(cap, base * 2 ** retry))
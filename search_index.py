@@ -0,0 +1,236 @@
+import os
+import re
+import math
+import zlib
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from task_store import ExpiredEntrySweeper
+
+# QA对的本地检索索引：每个任务的结果集单独建一份索引，新任务完成时只为该任务建索引，已有索引不需要重建
+
+# 索引文件目录，每个任务每个结果集版本一个子目录
+SEARCH_INDEX_DIR = os.getenv('SEARCH_INDEX_DIR', os.path.join(tempfile.gettempdir(), 'qa_extraction_search'))
+
+# 向量维数：特征哈希到固定维数，不需要保存词表
+SEARCH_DIM = int(os.getenv('SEARCH_DIM', '1024'))
+
+# QA对数量达到该值时建立倒排聚类（IVF）近似索引，查询只扫描最接近的几个簇；少于该值时直接全量计算
+SEARCH_ANN_MIN_ROWS = int(os.getenv('SEARCH_ANN_MIN_ROWS', '5000'))
+
+# 近似查询扫描的簇数，越大召回越高，查询越慢
+SEARCH_NPROBE = int(os.getenv('SEARCH_NPROBE', '8'))
+
+# 进程内缓存的已加载索引数
+SEARCH_CACHE_SIZE = 16
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_NON_CJK_RE = re.compile(r'[\W_a-z0-9]+')
+
+
+# 文本的特征：英文和数字按词，中文等按连续字符的单字和双字
+def _features(text):
+    text = str(text or '').lower()
+    features = _WORD_RE.findall(text)
+    for run in _NON_CJK_RE.split(text):
+        features.extend(run)
+        features.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return features
+
+
+# 特征哈希：低位决定维度，最高位决定符号（减少哈希冲突带来的偏差）。用crc32保证不同进程结果一致
+def _hashed_tf(text, dim):
+    counts = {}
+    for feature in _features(text):
+        h = zlib.crc32(feature.encode('utf-8'))
+        index = h % dim
+        counts[index] = counts.get(index, 0.0) + (1.0 if h >> 31 else -1.0)
+    indices = np.fromiter(counts, dtype=np.int32, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    # 次线性词频：1+log(tf)，保留符号
+    values = np.sign(values) * (1 + np.log(np.maximum(np.abs(values), 1)))
+    nonzero = values != 0
+    return indices[nonzero], values[nonzero]
+
+
+def _qa_text(row):
+    return f"{row.get('question', '')} {row.get('answer', '')}"
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# 球面k-means：在抽样上训练质心，再分批把所有向量分到最近的簇
+def _kmeans(vectors, k, iterations=10, sample_size=None, batch_rows=8192):
+    rng = np.random.default_rng(0)
+    n = len(vectors)
+    sample_size = min(n, sample_size or k * 64)
+    sample = np.asarray(vectors[np.sort(rng.choice(n, sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    assignment = np.empty(n, dtype=np.int32)
+    for start in range(0, n, batch_rows):
+        assignment[start:start + batch_rows] = np.argmax(vectors[start:start + batch_rows] @ centroids.T, axis=1)
+    return centroids.astype(np.float32), assignment
+
+
+def _index_name(task_id, name, version):
+    return f"{task_id}_{name}_v{version}"
+
+
+# 为任务的一组结果建立检索索引并返回索引目录，结果集不存在时返回None。
+# 向量按行保存在 vectors.npy 中，查询时以内存映射方式读取；先写临时目录再改名，并发构建不会读到不完整的索引
+def build_index(store, task_id, name='cleaned_qa', dim=None):
+    version = store.results_version(task_id, name)
+    if version is None:
+        return None
+    dim = dim or SEARCH_DIM
+    os.makedirs(SEARCH_INDEX_DIR, exist_ok=True)
+    path = os.path.join(SEARCH_INDEX_DIR, _index_name(task_id, name, version))
+    if os.path.isdir(path):
+        return path
+
+    # 第一遍：每个QA对的稀疏词频，以及每个维度出现的文档数
+    sparse = []
+    document_freq = np.zeros(dim, dtype=np.int64)
+    for row in store.iter_results(task_id, name):
+        indices, values = _hashed_tf(_qa_text(row), dim)
+        sparse.append((indices, values))
+        document_freq[indices] += 1
+    n = len(sparse)
+    idf = (np.log((1 + n) / (1 + document_freq)) + 1).astype(np.float32)
+
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(temp_path)
+    try:
+        vectors = np.lib.format.open_memmap(os.path.join(temp_path, 'vectors.npy'), mode='w+',
+                                            dtype=np.float32, shape=(n, dim))
+        for position, (indices, values) in enumerate(sparse):
+            vectors[position, indices] = _normalize(values * idf[indices])
+        del sparse
+        positions = np.arange(n, dtype=np.int64)
+
+        if n >= max(SEARCH_ANN_MIN_ROWS, 1):
+            # 按簇重排向量，同一簇的向量连续存放，查询时每个簇只需读取一段连续区域
+            centroids, assignment = _kmeans(vectors, max(1, int(math.sqrt(n))))
+            positions = np.argsort(assignment, kind='stable')
+            offsets = np.searchsorted(assignment[positions], np.arange(len(centroids) + 1))
+            sorted_vectors = np.lib.format.open_memmap(os.path.join(temp_path, 'sorted.npy'), mode='w+',
+                                                       dtype=np.float32, shape=(n, dim))
+            for start in range(0, n, 8192):
+                sorted_vectors[start:start + 8192] = vectors[positions[start:start + 8192]]
+            sorted_vectors.flush()
+            del vectors, sorted_vectors
+            os.replace(os.path.join(temp_path, 'sorted.npy'), os.path.join(temp_path, 'vectors.npy'))
+            np.save(os.path.join(temp_path, 'centroids.npy'), centroids)
+            np.save(os.path.join(temp_path, 'offsets.npy'), offsets.astype(np.int64))
+        else:
+            vectors.flush()
+            del vectors
+        np.save(os.path.join(temp_path, 'positions.npy'), positions)
+        np.save(os.path.join(temp_path, 'idf.npy'), idf)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # 其他进程已经建好同一版本的索引
+            if not os.path.isdir(path):
+                raise
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+    prefix = f"{task_id}_{name}_v"
+    _remove_dirs(entry for entry in os.listdir(SEARCH_INDEX_DIR)
+                 if entry.startswith(prefix) and '.' not in entry and entry != os.path.basename(path))
+    _sweeper.sweep()
+    return path
+
+
+class _Index:
+    def __init__(self, path):
+        self.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        self.positions = np.load(os.path.join(path, 'positions.npy'))
+        self.idf = np.load(os.path.join(path, 'idf.npy'))
+        self.dim = len(self.idf)
+        centroids_path = os.path.join(path, 'centroids.npy')
+        if os.path.exists(centroids_path):
+            self.centroids = np.load(centroids_path)
+            self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        else:
+            self.centroids = self.offsets = None
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        indices, values = _hashed_tf(text, self.dim)
+        vector[indices] = values * self.idf[indices]
+        return _normalize(vector)
+
+    # 返回最相似的k个 (结果位置, 相似度)
+    def search(self, text, k, nprobe=None):
+        query = self.embed(text)
+        if not query.any() or not len(self.positions):
+            return []
+        if self.centroids is None:
+            rows = np.arange(len(self.positions))
+            scores = self.vectors @ query
+        else:
+            nprobe = min(nprobe or SEARCH_NPROBE, len(self.centroids))
+            clusters = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in clusters])
+            scores = np.concatenate([self.vectors[self.offsets[c]:self.offsets[c + 1]] @ query for c in clusters])
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(self.positions[rows[i]]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _load_index(path):
+    with _cache_lock:
+        index = _cache.get(path)
+        if index is not None:
+            _cache.move_to_end(path)
+            return index
+    index = _Index(path)
+    with _cache_lock:
+        _cache[path] = index
+        while len(_cache) > SEARCH_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+# 在任务的一组结果中检索与query最相似的k个QA对，返回 [(相似度, QA对)]；结果集不存在时返回None。
+# 索引不存在（如任务完成时建索引失败、索引已被清理）时先建立索引
+def search(store, task_id, query, k=10, name='cleaned_qa'):
+    path = build_index(store, task_id, name)
+    if path is None:
+        return None
+    hits = _load_index(path).search(query, k)
+    rows = store.get_result_rows(task_id, name, [position for position, _ in hits])
+    return [(score, rows[position]) for position, score in hits if position in rows]
+
+
+def _remove_dirs(names):
+    for name in names:
+        path = os.path.join(SEARCH_INDEX_DIR, name)
+        with _cache_lock:
+            _cache.pop(path, None)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# 清理超过任务保留时间的索引（对应的任务已过期）
+_sweeper = ExpiredEntrySweeper(SEARCH_INDEX_DIR, _remove_dirs)
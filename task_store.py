@@ -0,0 +1,353 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+
+# 任务存储文件路径，多个进程（如gunicorn的多个worker）共用同一个文件即可共享任务状态；
+# 设为空字符串时使用进程内存储（重启后任务丢失，仅适合单进程）
+TASK_STORE_PATH = os.getenv('TASK_STORE_PATH', os.path.join(tempfile.gettempdir(), 'qa_extraction_tasks.sqlite3'))
+# 任务在最后一次更新后保留的时间（秒），默认24小时；进行中的任务会不断刷新更新时间，因此只有已结束或已中断的任务会过期
+TASK_TTL = float(os.getenv('TASK_TTL', str(24 * 3600)))
+
+
+# 进程内任务存储：任务状态和结果列表都保存在内存中
+class MemoryTaskStore:
+    def __init__(self, ttl=TASK_TTL, evict_interval=60):
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self._tasks = {}
+        self._results = {}
+        self._versions = {}
+        self._checkpoints = {}
+        self._uploads = {}
+        self._updated = {}
+        self._last_evict = 0.0
+        self._lock = threading.Lock()
+
+    def create(self, task_id, **fields):
+        now = time.time()
+        with self._lock:
+            self._maybe_evict(now)
+            self._tasks[task_id] = dict(fields)
+            self._updated[task_id] = now
+
+    # 返回任务状态的副本（附带最后更新时间updated_at），任务不存在时返回None
+    def get(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task, updated_at=self._updated[task_id]) if task is not None else None
+
+    def __contains__(self, task_id):
+        with self._lock:
+            return task_id in self._tasks
+
+    # 合并更新任务状态中的字段，任务不存在（已过期或被删除）时忽略
+    def update(self, task_id, **fields):
+        with self._lock:
+            if task_id in self._tasks:
+                self._tasks[task_id].update(fields)
+                self._updated[task_id] = time.time()
+
+    # 保存任务的一组结果（如清洗后的QA对、筛选后的QA对），覆盖同名的旧结果
+    def set_results(self, task_id, name, rows):
+        with self._lock:
+            self._results[(task_id, name)] = list(rows)
+            self._versions[(task_id, name)] = self._versions.get((task_id, name), 0) + 1
+            self._updated[task_id] = time.time()
+
+    # 读取任务的一组结果，不存在时返回None
+    def get_results(self, task_id, name):
+        with self._lock:
+            rows = self._results.get((task_id, name))
+            return list(rows) if rows is not None else None
+
+    # 逐行读取任务的一组结果，不存在时不产出任何行
+    def iter_results(self, task_id, name, chunk_size=1000):
+        rows = self.get_results(task_id, name) or []
+        yield from rows
+
+    # 按位置读取结果中的若干行，返回 {位置: 行}，不存在的位置不包含在内
+    def get_result_rows(self, task_id, name, positions):
+        with self._lock:
+            rows = self._results.get((task_id, name)) or []
+            return {position: rows[position] for position in positions if 0 <= position < len(rows)}
+
+    # 结果集的版本号，每次set_results加1，用于判断导出文件是否需要重新生成；不存在时返回None
+    def results_version(self, task_id, name):
+        with self._lock:
+            return self._versions.get((task_id, name))
+
+    # 记录某个阶段中单个工单的处理结果（断点），同一工单重复记录时覆盖
+    def save_checkpoint(self, task_id, stage, key, value):
+        with self._lock:
+            self._checkpoints.setdefault((task_id, stage), {})[str(key)] = value
+            self._updated[task_id] = time.time()
+
+    # 读取某个阶段所有已记录的断点，返回 {工单键: 结果}
+    def get_checkpoints(self, task_id, stage):
+        with self._lock:
+            return dict(self._checkpoints.get((task_id, stage), {}))
+
+    # 保存上传的原始文件，用于恢复中断的任务
+    def save_upload(self, task_id, data):
+        with self._lock:
+            self._uploads[task_id] = data
+
+    def get_upload(self, task_id):
+        with self._lock:
+            return self._uploads.get(task_id)
+
+    def delete(self, task_id):
+        with self._lock:
+            self._delete(task_id)
+
+    def _delete(self, task_id):
+        self._tasks.pop(task_id, None)
+        self._updated.pop(task_id, None)
+        self._uploads.pop(task_id, None)
+        for store in (self._results, self._versions, self._checkpoints):
+            for key in [key for key in store if key[0] == task_id]:
+                del store[key]
+
+    def _maybe_evict(self, now):
+        if not self.ttl or now - self._last_evict < self.evict_interval:
+            return
+        self._last_evict = now
+        for task_id in [task_id for task_id, updated in self._updated.items() if now - updated > self.ttl]:
+            self._delete(task_id)
+
+
+# 基于SQLite的任务存储：任务状态以JSON保存，结果按行保存在单独的表中，不常驻进程内存。
+# 同一进程内所有线程共用一个连接，读写由锁串行化；多个进程之间由SQLite的文件锁保证一致
+class SQLiteTaskStore:
+    def __init__(self, path, ttl=TASK_TTL, evict_interval=60):
+        self.path = path
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self._last_evict = 0.0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks (updated_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_results ("
+            "task_id TEXT NOT NULL, name TEXT NOT NULL, position INTEGER NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (task_id, name, position))"
+        )
+        # 记录已保存的结果集，用于区分“结果为空”和“没有结果”
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_result_sets ("
+            "task_id TEXT NOT NULL, name TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 1, PRIMARY KEY (task_id, name))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_checkpoints ("
+            "task_id TEXT NOT NULL, stage TEXT NOT NULL, item_key TEXT NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (task_id, stage, item_key))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS task_uploads (task_id TEXT PRIMARY KEY, data BLOB NOT NULL)")
+
+    def create(self, task_id, **fields):
+        now = time.time()
+        with self._lock:
+            self._maybe_evict(now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, data, updated_at) VALUES (?, ?, ?)",
+                (task_id, json.dumps(fields, ensure_ascii=False), now)
+            )
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data, updated_at FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return dict(json.loads(row[0]), updated_at=row[1]) if row else None
+
+    def __contains__(self, task_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM tasks WHERE task_id = ?", (task_id,)).fetchone() is not None
+
+    def update(self, task_id, **fields):
+        with self._lock, self._transaction():
+            row = self._conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return
+            task = json.loads(row[0])
+            task.update(fields)
+            self._conn.execute(
+                "UPDATE tasks SET data = ?, updated_at = ? WHERE task_id = ?",
+                (json.dumps(task, ensure_ascii=False), time.time(), task_id)
+            )
+
+    def set_results(self, task_id, name, rows):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM task_results WHERE task_id = ? AND name = ?", (task_id, name))
+            self._conn.execute(
+                "INSERT INTO task_result_sets (task_id, name) VALUES (?, ?) "
+                "ON CONFLICT (task_id, name) DO UPDATE SET version = version + 1",
+                (task_id, name)
+            )
+            self._conn.executemany(
+                "INSERT INTO task_results (task_id, name, position, data) VALUES (?, ?, ?, ?)",
+                ((task_id, name, position, json.dumps(row, ensure_ascii=False)) for position, row in enumerate(rows))
+            )
+            self._conn.execute("UPDATE tasks SET updated_at = ? WHERE task_id = ?", (time.time(), task_id))
+
+    def get_results(self, task_id, name):
+        with self._lock:
+            if self._conn.execute(
+                "SELECT 1 FROM task_result_sets WHERE task_id = ? AND name = ?", (task_id, name)
+            ).fetchone() is None:
+                return None
+            cursor = self._conn.execute(
+                "SELECT data FROM task_results WHERE task_id = ? AND name = ? ORDER BY position", (task_id, name)
+            )
+            return [json.loads(data) for data, in cursor]
+
+    # 按位置分页读取，每页单独加锁，读取大结果集时不会长时间占用连接，内存占用与结果数量无关
+    def iter_results(self, task_id, name, chunk_size=1000):
+        position = 0
+        while True:
+            with self._lock:
+                page = self._conn.execute(
+                    "SELECT position, data FROM task_results WHERE task_id = ? AND name = ? AND position >= ? "
+                    "ORDER BY position LIMIT ?", (task_id, name, position, chunk_size)
+                ).fetchall()
+            for _, data in page:
+                yield json.loads(data)
+            if len(page) < chunk_size:
+                return
+            position = page[-1][0] + 1
+
+    def get_result_rows(self, task_id, name, positions):
+        positions = list(positions)
+        if not positions:
+            return {}
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT position, data FROM task_results WHERE task_id = ? AND name = ? "
+                f"AND position IN ({','.join('?' * len(positions))})", (task_id, name, *positions)
+            )
+            return {position: json.loads(data) for position, data in cursor}
+
+    def results_version(self, task_id, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM task_result_sets WHERE task_id = ? AND name = ?", (task_id, name)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_checkpoint(self, task_id, stage, key, value):
+        with self._lock, self._transaction():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO task_checkpoints (task_id, stage, item_key, data) VALUES (?, ?, ?, ?)",
+                (task_id, stage, str(key), json.dumps(value, ensure_ascii=False))
+            )
+            self._conn.execute("UPDATE tasks SET updated_at = ? WHERE task_id = ?", (time.time(), task_id))
+
+    def get_checkpoints(self, task_id, stage):
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT item_key, data FROM task_checkpoints WHERE task_id = ? AND stage = ?", (task_id, stage)
+            )
+            return {key: json.loads(data) for key, data in cursor}
+
+    def save_upload(self, task_id, data):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO task_uploads (task_id, data) VALUES (?, ?)", (task_id, data))
+
+    def get_upload(self, task_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM task_uploads WHERE task_id = ?", (task_id,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def delete(self, task_id):
+        with self._lock, self._transaction():
+            self._delete(task_id)
+
+    def _delete(self, task_id):
+        self._conn.execute("DELETE FROM task_checkpoints WHERE task_id = ?", (task_id,))
+        self._conn.execute("DELETE FROM task_uploads WHERE task_id = ?", (task_id,))
+        self._conn.execute("DELETE FROM task_results WHERE task_id = ?", (task_id,))
+        self._conn.execute("DELETE FROM task_result_sets WHERE task_id = ?", (task_id,))
+        self._conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    # 写事务：BEGIN IMMEDIATE提前获取写锁，避免多进程同时“读-改-写”同一任务时互相覆盖
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def _maybe_evict(self, now):
+        if not self.ttl or now - self._last_evict < self.evict_interval:
+            return
+        self._last_evict = now
+        with self._transaction():
+            expired = [task_id for task_id, in self._conn.execute(
+                "SELECT task_id FROM tasks WHERE updated_at < ?", (now - self.ttl,)
+            )]
+            for task_id in expired:
+                self._delete(task_id)
+        if expired:
+            logging.info(f"已清理 {len(expired)} 个过期任务")
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+# 清理缓存目录（导出文件、检索索引等）中超过任务保留时间的条目（按修改时间），对应的任务已过期。
+# remove(names)删除目录中指定名称的条目；每interval秒最多扫描一次
+class ExpiredEntrySweeper:
+    def __init__(self, directory, remove, ttl=TASK_TTL, interval=60):
+        self.directory = directory
+        self.remove = remove
+        self.ttl = ttl
+        self.interval = interval
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            if not self.ttl or now - self._last_sweep < self.interval:
+                return
+            self._last_sweep = now
+        try:
+            expired = [entry.name for entry in os.scandir(self.directory) if now - entry.stat().st_mtime > self.ttl]
+        except OSError as e:
+            logging.warning(f"清理 {self.directory} 中过期的条目时出错: {e}")
+            return
+        self.remove(expired)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# 进程内共享的任务存储；未配置路径或无法创建存储文件时使用进程内存储
+def get_task_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if TASK_STORE_PATH:
+                try:
+                    _store = SQLiteTaskStore(TASK_STORE_PATH)
+                except (OSError, sqlite3.Error) as e:
+                    logging.warning(f"无法创建任务存储 {TASK_STORE_PATH}，改用进程内存储: {e}")
+            if _store is None:
+                _store = MemoryTaskStore()
+        return _store
@@ -0,0 +1,31 @@
+import os
+import json
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在新的解释器中去重一组近似重复的问题，输出每个问题是否被合并和MinHash签名
+_SCRIPT = """
+import json
+from dedup import QADeduplicator
+questions = ['如何重置登录密码？', '如何重置登录密码', '怎样重置登录的密码？', '发票什么时候可以开具？',
+             '发票什么时候可以开具呢', '退款多久到账？', 'How do I reset my password?', 'how do i reset my password']
+dedup = QADeduplicator()
+merged = [dedup.add({'question': q, 'answer': '', 'work_order_id': i}) is not None for i, q in enumerate(questions)]
+print(json.dumps({'merged': merged, 'signature': [int(x) for x in dedup._signature(questions[0])]}))
+"""
+
+
+def _run(hash_seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(hash_seed))
+    result = subprocess.run([sys.executable, '-c', _SCRIPT], cwd=ROOT_DIR, env=env, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout)
+
+
+# 去重结果不随进程的字符串哈希盐（PYTHONHASHSEED）变化
+def test_dedup_is_stable_across_hash_seeds():
+    results = [_run(seed) for seed in (0, 1, 12345)]
+    assert results[0]['merged'] == [False, True, False, False, True, False, False, True]
+    assert all(result == results[0] for result in results[1:])
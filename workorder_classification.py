@@ -1,10 +1,11 @@
+import sys
 import pandas as pd
 import requests
 import json
 import time
 from openpyxl import Workbook
-from collections import defaultdict
 from tqdm import tqdm
+from ingest import group_messages
 
 # 读取Excel文件
 def read_excel(file_path):
@@ -15,29 +16,9 @@ def read_excel(file_path):
         print(f"读取Excel文件时出错: {e}")
         return None
 
-# 按工单ID分组对话内容
+# 按工单ID分组对话内容（oa_user_name为空的消息记为系统消息）
 def group_by_work_order(df):
-    work_orders = defaultdict(list)
-    
-    # 确保数据按created_at排序
-    df = df.sort_values(by=['work_order_id', 'created_at'])
-    
-    # 添加进度条
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="分组工单数据"):
-        work_id = row['work_order_id']
-        content = row['content']
-        user_name = row['oa_user_name'] if not pd.isna(row['oa_user_name']) else '系统'
-        
-        # 跳过空内容
-        if pd.isna(content) or content.strip() == '':
-            continue
-            
-        work_orders[work_id].append({
-            'user': user_name,
-            'content': content
-        })
-    
-    return work_orders
+    return group_messages(df, fill_user='系统')
 
 # 调用百炼API生成QA对
 def generate_qa_pairs(api_key, conversations, model_name):
@@ -217,12 +198,10 @@ def process_file(input_file, output_file, api_key, model_name):
     finally:
         print("程序执行完毕")
 
-# 主函数
-def main():
-    input_file = ""
-    output_file = ""
-    api_key = ""  
-    process_file(input_file, output_file, api_key)
+# 主函数：命令行批量处理，使用与网页端相同的处理流程（见 batch.py）
+def main(argv=None):
+    from batch import main as batch_main
+    return batch_main(argv)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())